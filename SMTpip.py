@@ -3,11 +3,23 @@ import time
 import logging
 import argparse
 from z3 import Context
+from closure import SCHEDULE_BREADTH, SCHEDULES
+from closure_cache import DEFAULT_CLOSURE_CACHE_SIZE, open_closure_cache
 from create_requirements import generate_requirements_txt, read_solution_file
-from dependency import fetch_direct_dependencies, fetch_transitive_dependencies
-from read import read_json_file, read_requirements
+from dependency import (
+    fetch_direct_dependencies,
+    fetch_transitive_dependencies,
+    marker_environment,
+    stream_transitive_dependencies,
+)
+from dominance import prune_dominated
+from equivalence import collapse_version_classes
+from kgraph import LazyProjects
+from version_order import DEFAULT_MATCH_CACHE_SIZE, PRERELEASE_POLICIES, PRERELEASES_EXPLICIT, MatchCache
+from read import read_kgraph, read_requirements
+from presolve import presolve
 from requirements import parse_requirements
-from smt import generate_smt_expression, smt_solver
+from smt import generate_smt_expression, generate_smt_expression_streaming, smt_solver
 
 
 # Import functionalities from python_version_resolver
@@ -50,19 +62,103 @@ def log_execution_time(action_name, start_time, end_time):
     logging.info(f"{action_name} execution time: {end_time - start_time:.2f} seconds")
 
 
-def read_input_files(directory):
+def log_closure_stats(fetch_stats, closure_cache, closure_schedule, prune_unsatisfiable, projects_data):
+    """
+    Log the counters of the dependency closure walk and the caches it used.
+    """
+    logging.info(
+        f"Dependency parse calls: {fetch_stats['parse_calls']}, "
+        f"avoided: {fetch_stats['parse_calls_avoided']}"
+    )
+    logging.info(f"Dependency edges skipped by environment markers: {fetch_stats['marker_pruned']}")
+    logging.info(
+        f"Dependency edges no version satisfies: {fetch_stats['unsatisfiable_edges']} "
+        f"({'their package versions are ruled out' if prune_unsatisfiable else 'ignored'})"
+    )
+    logging.info(
+        f"Closure walk ({closure_schedule}): {fetch_stats['expanded']} package versions expanded, "
+        f"peak frontier {fetch_stats['peak_frontier']}"
+    )
+    if closure_cache is not None:
+        logging.info(
+            f"Closure cache {closure_cache.path}: {closure_cache.hits} hits, "
+            f"{closure_cache.misses} misses"
+        )
+        if closure_cache.emptied:
+            # Merged deltas change the version ranks of dependents too, so nothing is kept
+            logging.info(
+                f"Closure cache emptied, its entries were built for another knowledge graph or "
+                f"cache format (generation {closure_cache.previous_generation} -> {closure_cache.generation})"
+            )
+    logging.info(
+        "Closure frontier (expanded: queued): "
+        + ", ".join(f"{expanded}: {queued}" for expanded, queued in fetch_stats["frontier"])
+    )
+    if isinstance(projects_data["projects"], LazyProjects):
+        logging.info(
+            f"Knowledge graph packages decoded: {projects_data['projects'].decoded_count} "
+            f"of {len(projects_data['projects'])}"
+        )
+        match_cache = projects_data["projects"].match_cache
+        logging.info(
+            f"Version match cache: {match_cache.hits} hits, {match_cache.misses} misses, "
+            f"{len(match_cache)} entries"
+        )
+        interner = projects_data["projects"].interner
+        if interner is not None:
+            logging.info(
+                f"Dependency lists shared: {interner.unique_lists} distinct "
+                f"of {interner.lists_seen} decoded"
+            )
+
+
+def read_input_files(directory, kg_backend="auto"):
     """
     Read input files from the specified directory.
     """
     requirements_txt = read_requirements(directory)
-    projects_data = read_json_file(os.getcwd())  # Use current working directory for projects_data
+    # "python" is looked up after solving to pick the interpreter version
+    wanted_packages = list(parse_requirements(requirements_txt)) + ["python"]
+    projects_data = read_kgraph(os.getcwd(), packages=wanted_packages, backend=kg_backend)  # Use current working directory for projects_data
     logging.info("Input files successfully read.")
     return requirements_txt, projects_data
 
 
-def main(directory):
+def main(
+    directory,
+    *,
+    kg_backend="auto",
+    match_cache_size=DEFAULT_MATCH_CACHE_SIZE,
+    environment=None,
+    prereleases=PRERELEASES_EXPLICIT,
+    closure_schedule=SCHEDULE_BREADTH,
+    workers=1,
+    closure_cache_size=DEFAULT_CLOSURE_CACHE_SIZE,
+    collapse_versions=True,
+    presolve_candidates=True,
+    prune_unsatisfiable=False,
+    drop_dominated=True,
+    stream=False,
+    python_version=None,
+):
     """
     Main function to execute the dependency resolution process.
+
+    `environment` is the target environment from `marker_environment`; dependencies whose
+    marker is false in it are left out. Without it, markers are ignored. `prereleases` is
+    the pre-release policy applied when candidate versions are matched. `closure_schedule`
+    is the order the dependency closure is walked in, and `workers` the processes walking it.
+    `closure_cache_size` bounds the persistent closure cache kept next to the knowledge
+    graph; 0 disables it. With `collapse_versions`, only one representative of each class of
+    interchangeable versions is encoded. With `presolve_candidates`, versions that constraint
+    propagation rules out are removed before encoding. With `prune_unsatisfiable`, a version
+    with a dependency that no version satisfies is ruled out instead of the dependency being
+    ignored. With `drop_dominated`, versions that a newer candidate can always replace are
+    dropped. With `stream`, the dependency edges go from the closure walk to the SMT encoder in
+    batches and are never held all at once; the passes that need the whole problem, presolve,
+    version classes and dominance pruning, are skipped. `python_version` is the target Python
+    version, if one was given; the interpreter written to the install script is one of its
+    releases.
     """
     log_file = "execution_log.txt"
 
@@ -73,36 +169,125 @@ def main(directory):
     try:
         # Read files
         start_time = time.time()
-        requirements_txt, projects_data = read_input_files(directory)
+        requirements_txt, projects_data = read_input_files(directory, kg_backend)
         end_time = time.time()
         log_execution_time("Reading files", start_time, end_time)
+        if isinstance(projects_data["projects"], LazyProjects):
+            projects_data["projects"].match_cache = MatchCache(match_cache_size)
+            projects_data["projects"].prerelease_policy = prereleases
 
         # Parse requirements
         start_time = time.time()
-        requirements = parse_requirements(requirements_txt)
+        requested_extras = {}
+        requirements = parse_requirements(requirements_txt, environment, requested_extras)
         end_time = time.time()
         log_execution_time("Parsing requirements", start_time, end_time)
 
         # Fetch dependencies
         start_time = time.time()
-        direct_dependencies = fetch_direct_dependencies(requirements, projects_data)
-        transitive_dependencies = fetch_transitive_dependencies(direct_dependencies, projects_data)
-        end_time = time.time()
-        log_execution_time("Fetching dependencies", start_time, end_time)
-
-        # Generate SMT expression
-        ctx = Context()
-        start_time = time.time()
-        solver = generate_smt_expression(
-            direct_dependencies, transitive_dependencies, ctx, add_soft_clauses=False, minimize_packages=False
+        direct_dependencies = fetch_direct_dependencies(requirements, projects_data, requested_extras)
+        fetch_stats = {}
+        closure_cache = None
+        if closure_cache_size:
+            closure_cache = open_closure_cache(projects_data["projects"], closure_cache_size)
+        closure = (
+            direct_dependencies,
+            projects_data,
+            fetch_stats,
+            environment,
+            closure_schedule,
+            workers,
+            closure_cache,
+            prune_unsatisfiable,
         )
-        end_time = time.time()
-        log_execution_time("Generating SMT expression", start_time, end_time)
-
-        # Save SMT expression
         smt_expression_file = os.path.join(directory, "SMT_expression.txt")
-        with open(smt_expression_file, "w") as file:
-            file.write(str(solver))
+        ctx = Context()
+
+        if stream:
+            # The walk hands its edges straight to the encoder, which writes the expression
+            # as it goes, so the dependencies are never held in full
+            with open(smt_expression_file, "w") as file:
+                solver = generate_smt_expression_streaming(
+                    direct_dependencies,
+                    stream_transitive_dependencies(*closure),
+                    ctx,
+                    add_soft_clauses=False,
+                    minimize_packages=False,
+                    expression_file=file,
+                )
+            if closure_cache is not None:
+                closure_cache.close()
+            end_time = time.time()
+            log_execution_time("Fetching dependencies and generating SMT expression", start_time, end_time)
+            log_closure_stats(fetch_stats, closure_cache, closure_schedule, prune_unsatisfiable, projects_data)
+            logging.info("Streaming: presolve, version classes and dominance pruning skipped")
+            # Each of them needs the whole problem at once
+            presolve_candidates = collapse_versions = drop_dominated = False
+        else:
+            transitive_dependencies = fetch_transitive_dependencies(*closure)
+            if closure_cache is not None:
+                closure_cache.close()
+            end_time = time.time()
+            log_execution_time("Fetching dependencies", start_time, end_time)
+            log_closure_stats(fetch_stats, closure_cache, closure_schedule, prune_unsatisfiable, projects_data)
+
+        if presolve_candidates:
+            start_time = time.time()
+            presolve_stats = {}
+            direct_dependencies, transitive_dependencies = presolve(
+                direct_dependencies, transitive_dependencies, presolve_stats
+            )
+            end_time = time.time()
+            log_execution_time("Presolve", start_time, end_time)
+            if presolve_stats["unsatisfiable"]:
+                logging.info("Presolve: a required package has no possible version left")
+            logging.info(
+                f"Presolve: {presolve_stats['versions_removed']} candidate versions and "
+                f"{presolve_stats['clauses_removed']} dependency clauses removed, "
+                f"{presolve_stats['required']} packages required"
+            )
+
+        if collapse_versions:
+            start_time = time.time()
+            class_stats = {}
+            direct_dependencies, transitive_dependencies, _ = collapse_version_classes(
+                direct_dependencies, transitive_dependencies, class_stats
+            )
+            end_time = time.time()
+            log_execution_time("Collapsing version classes", start_time, end_time)
+            logging.info(
+                f"Version classes: {class_stats['versions']} candidate versions in "
+                f"{class_stats['classes']} classes, dependency clauses "
+                f"{class_stats['clauses_before']} -> {class_stats['clauses_after']}"
+            )
+
+        if drop_dominated:
+            start_time = time.time()
+            dominance_stats = {}
+            direct_dependencies, transitive_dependencies, _ = prune_dominated(
+                direct_dependencies, transitive_dependencies, dominance_stats
+            )
+            end_time = time.time()
+            log_execution_time("Pruning dominated versions", start_time, end_time)
+            logging.info(
+                f"Dominance: {dominance_stats['versions_dropped']} dominated candidate versions and "
+                f"{dominance_stats['clauses_removed']} dependency clauses removed"
+            )
+
+        if not stream:
+            # Generate SMT expression and save it in the form the streaming encoder writes
+            start_time = time.time()
+            with open(smt_expression_file, "w") as file:
+                solver = generate_smt_expression(
+                    direct_dependencies,
+                    transitive_dependencies,
+                    ctx,
+                    add_soft_clauses=False,
+                    minimize_packages=False,
+                    expression_file=file,
+                )
+            end_time = time.time()
+            log_execution_time("Generating SMT expression", start_time, end_time)
         logging.info(f"SMT expression saved to: {smt_expression_file}")
 
         # Solve SMT expression
@@ -147,7 +332,9 @@ def main(directory):
         merged_constraints = merge_constraints(python_versions)
 
         # Filter compatible Python versions from JSON data
-        valid_python_versions = filter_python_versions(merged_constraints, python_versions_data)
+        valid_python_versions = filter_python_versions(
+            merged_constraints, python_versions_data, prereleases, python_version
+        )
 
         # Get the latest Python version
         latest_python_version = get_latest_version(valid_python_versions)
@@ -170,6 +357,107 @@ if __name__ == "__main__":
         required=True,
         help="Directory containing requirements.txt and other input files.",
     )
+    parser.add_argument(
+        "--kg-backend",
+        choices=["auto", "sqlite"],
+        default="auto",
+        help="Knowledge graph backend: 'auto' picks the compiled store, KGraph.json or KGraph.zip; "
+        "'sqlite' queries KGraph.sqlite.",
+    )
+    parser.add_argument(
+        "--match-cache-size",
+        type=int,
+        default=DEFAULT_MATCH_CACHE_SIZE,
+        help="Most specifier matches to memoize during the dependency walk (0 disables the cache).",
+    )
+    parser.add_argument(
+        "--python-version",
+        type=str,
+        help="Target Python version for environment markers, e.g. 3.8 or 3.8.10.",
+    )
+    parser.add_argument(
+        "--platform",
+        type=str,
+        help="Target sys.platform for environment markers, e.g. linux, win32 or darwin.",
+    )
+    parser.add_argument(
+        "--implementation",
+        type=str,
+        help="Target Python implementation for environment markers, e.g. cpython or pypy.",
+    )
+    parser.add_argument(
+        "--prereleases",
+        choices=PRERELEASE_POLICIES,
+        default=PRERELEASES_EXPLICIT,
+        help="Pre-release policy: 'stable' never picks them, 'explicit' only when a specifier names one "
+        "or nothing else matches, 'all' treats them like final releases.",
+    )
+    parser.add_argument(
+        "--closure-schedule",
+        choices=SCHEDULES,
+        default=SCHEDULE_BREADTH,
+        help="Order the dependency closure is walked in: 'breadth' as versions are reached, "
+        "'newest' the newest pending version first.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes that walk the dependency closure (0 uses one per CPU).",
+    )
+    parser.add_argument(
+        "--closure-cache-size",
+        type=int,
+        default=DEFAULT_CLOSURE_CACHE_SIZE,
+        help="Most package version expansions kept in the closure cache next to the knowledge graph "
+        "(0 disables the cache).",
+    )
+    parser.add_argument(
+        "--no-version-classes",
+        action="store_true",
+        help="Encode every candidate version instead of one per class of versions with identical "
+        "dependencies and candidate-set membership.",
+    )
+    parser.add_argument(
+        "--no-presolve",
+        action="store_true",
+        help="Hand every candidate version to the solver instead of first removing those that "
+        "constraint propagation rules out.",
+    )
+    parser.add_argument(
+        "--prune-unsatisfiable",
+        action="store_true",
+        help="Rule out package versions with a dependency that no version satisfies, instead of "
+        "ignoring that dependency.",
+    )
+    parser.add_argument(
+        "--no-dominance",
+        action="store_true",
+        help="Keep candidate versions that a newer candidate, accepted wherever they are and "
+        "needing no more than they do, can always replace.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Encode dependency edges as the closure walk finds them instead of collecting them "
+        "first; uses less memory, but skips presolve, version classes and dominance pruning.",
+    )
     args = parser.parse_args()
 
-    main(args.directory)
+    environment = marker_environment(args.python_version, args.platform, args.implementation)
+    main(
+        args.directory,
+        kg_backend=args.kg_backend,
+        match_cache_size=args.match_cache_size,
+        environment=environment,
+        prereleases=args.prereleases,
+        closure_schedule=args.closure_schedule,
+        workers=args.workers or None,
+        closure_cache_size=args.closure_cache_size,
+        collapse_versions=not args.no_version_classes,
+        presolve_candidates=not args.no_presolve,
+        prune_unsatisfiable=args.prune_unsatisfiable,
+        drop_dominated=not args.no_dominance,
+        stream=args.stream,
+        python_version=args.python_version,
+    )
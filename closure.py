@@ -0,0 +1,548 @@
+import heapq
+import math
+import multiprocessing
+import os
+from collections import deque
+
+from packaging.utils import canonicalize_name
+
+from closure_cache import ClosureCache
+from dependency import (
+    extra_package,
+    find_matching_versions_many,
+    marker_applies,
+    marker_extras,
+    parse_dependency_record,
+    resolve_package,
+    split_extras,
+)
+from version_order import PRERELEASES_EXPLICIT, VersionIndex, VersionSet
+
+
+# Worklist schedules: "breadth" expands package versions in the order they were reached,
+# "newest" always expands the newest pending version of any package first
+SCHEDULE_BREADTH = "breadth"
+SCHEDULE_NEWEST = "newest"
+SCHEDULES = (SCHEDULE_BREADTH, SCHEDULE_NEWEST)
+
+# Frontier size is recorded every this many expansions
+DEFAULT_FRONTIER_SAMPLE = 256
+
+# Frontiers smaller than this are expanded in the main process. Matching one package version
+# takes about 15 µs once its package is decoded, so a frontier has to be this wide before the
+# work outweighs handing tasks to workers and pickling their results back
+DEFAULT_MIN_PARALLEL = 2048
+
+# Edges handed out at a time by `ClosureWalk.edges`
+DEFAULT_EDGE_BATCH = 4096
+
+# A node id is the package id shifted left by this, plus the version rank
+_RANK_BITS = 32
+_RANK_MASK = (1 << _RANK_BITS) - 1
+
+
+class ClosureWalk:
+    """
+    Iterative walk of the transitive dependency closure over a worklist.
+
+    Each package version is a node with an integer id, (package id << 32) | version rank, so
+    the worklist holds plain integers and the visited set is one bitset of version ranks per
+    package id. Nodes are expanded breadth-first
+    or newest version first, and `run` can stop after a number of expansions and be called
+    again to carry on where it left off.
+
+    A requested extra is a package of its own, e.g. "requests[socks]", over the versions of
+    its base package. Its version v depends on the base package at exactly v plus the edges
+    conditional on the extra, and the base package's versions keep only their other edges.
+    Extra edges therefore only constrain a solution when a chosen parent, or requirements.txt,
+    asks for the extra.
+
+    `result` returns the closure in the form `fetch_transitive_dependencies` returns; it is
+    complete once `done` is true. `edges` instead hands out the dependency edges in batches as
+    they are found, without keeping them.
+    """
+
+    def __init__(
+        self,
+        projects_data,
+        stats=None,
+        environment=None,
+        schedule=SCHEDULE_BREADTH,
+        frontier_sample=DEFAULT_FRONTIER_SAMPLE,
+        cache=None,
+        keep_unsatisfiable=False,
+    ):
+        """
+        Parameters:
+            projects_data (dict): A dictionary containing project data, including available versions and their dependencies.
+            stats (dict): Optional dictionary that receives the walk counters, see `fetch_transitive_dependencies`,
+                          plus "expanded", the package versions walked, "peak_frontier", the largest
+                          worklist seen, and "frontier", (expanded, worklist size) samples.
+            environment (dict): Optional target environment from `marker_environment`.
+            schedule (str): SCHEDULE_BREADTH or SCHEDULE_NEWEST.
+            frontier_sample (int): Record the worklist size every this many expansions.
+            cache (ClosureCache): Optional persistent cache of expansions for this knowledge graph;
+                                  cached package versions are not matched again.
+            keep_unsatisfiable (bool): Keep dependencies that no version satisfies, as empty
+                                       candidate sets, so their dependents can be ruled out.
+                                       By default such edges are dropped.
+        """
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown closure schedule: {schedule}")
+        self.projects = projects_data["projects"]
+        self.stats = {} if stats is None else stats
+        self.stats.update(
+            parse_calls=0,
+            parse_calls_avoided=0,
+            marker_pruned=0,
+            unsatisfiable_edges=0,
+            expanded=0,
+            peak_frontier=0,
+            frontier=[],
+        )
+        self.environment = environment
+        self.schedule = schedule
+        self.frontier_sample = frontier_sample
+        self.cache = cache
+        self.keep_unsatisfiable = keep_unsatisfiable
+        self._context = ClosureCache.context_key(
+            environment, getattr(self.projects, "prerelease_policy", PRERELEASES_EXPLICIT), keep_unsatisfiable
+        )
+
+        self._records = {}  # Dependency strings repeat across versions, parse each one once
+        self._marker_results = {}  # The environment is fixed for the walk, evaluate each marker once
+        self._package_ids = {}  # Package, e.g. "requests" or "requests[socks]" -> package id
+        self._packages = []  # Package id -> (package, VersionIndex, knowledge graph key, extras)
+        self._visited = {}  # Package id -> bits of the version ranks ever queued
+        self._dependencies = {}  # Node id -> dependencies of the package version
+        self._edge_batch = None  # Edges not handed out yet while `edges` streams the walk
+        self._queue = deque() if schedule == SCHEDULE_BREADTH else []
+        self._sequence = 0  # Tie-breaker that keeps the priority queue stable
+
+        # Compiled and SQLite stores hand out pre-parsed edges, so the walk does not touch
+        # the decoded package entries
+        self._dependency_edges = getattr(self.projects, "dependency_edges", None)
+
+    @property
+    def frontier_size(self):
+        """
+        Returns the number of nodes waiting to be expanded.
+        """
+        return len(self._queue)
+
+    @property
+    def done(self):
+        return not self._queue
+
+    def add(self, package, versions):
+        """
+        Queue versions of a package, given by its knowledge graph key, or of an extra of it such
+        as "requests[socks]", as roots of the walk.
+        """
+        if not isinstance(versions, VersionSet):
+            index = self._version_index(package, versions)
+            bits = 0
+            for version in versions:
+                bits |= 1 << index.ranks[version]
+            versions = VersionSet(index, bits)
+        self._queue_versions(package, versions)
+
+    def run(self, max_steps=None):
+        """
+        Expand queued nodes until the worklist is empty or `max_steps` nodes were expanded.
+
+        Returns:
+            bool: True when the closure is complete.
+        """
+        for _ in self._expansions(max_steps):
+            pass
+        return self._finish()
+
+    def edges(self, batch_size=DEFAULT_EDGE_BATCH):
+        """
+        Walk the closure and yield its dependency edges in batches instead of keeping them.
+
+        Each edge is ("package==version", dependency, VersionSet of matching versions). An
+        edge is handed out once the package version is expanded, in the order the schedule
+        walks them, and is not kept by the walk afterwards, so `result` stays empty.
+
+        Parameters:
+            batch_size (int): Yield once at least this many edges are pending.
+
+        Yields:
+            list: A batch of edges.
+        """
+        self._edge_batch = []
+        try:
+            for _ in self._expansions():
+                if len(self._edge_batch) >= batch_size:
+                    batch, self._edge_batch = self._edge_batch, []
+                    yield batch
+            self._finish()
+            if self._edge_batch:
+                batch, self._edge_batch = self._edge_batch, []
+                yield batch
+        finally:
+            self._edge_batch = None
+
+    def _expansions(self, max_steps=None):
+        """
+        Expand queued nodes, yielding after each one, until the worklist is empty or
+        `max_steps` nodes were expanded.
+        """
+        steps = 0
+        while self._queue and (max_steps is None or steps < max_steps):
+            node = self._pop()
+            self._expand(node)
+            self._count_expansion()
+            steps += 1
+            yield
+
+    def _count_expansion(self):
+        stats = self.stats
+        stats["expanded"] += 1
+        if stats["expanded"] % self.frontier_sample == 0:
+            stats["frontier"].append((stats["expanded"], len(self._queue)))
+
+    def _finish(self):
+        stats = self.stats
+        if not self._queue and (not stats["frontier"] or stats["frontier"][-1][0] != stats["expanded"]):
+            stats["frontier"].append((stats["expanded"], 0))
+        if not self._queue and self.cache is not None:
+            self.cache.flush()
+        return not self._queue
+
+    def result(self):
+        """
+        Returns the dependencies found so far as "package==version" -> {dependency: versions}.
+
+        Keys are ordered by package name, then newest version first, so the result and the
+        SMT expression built from it do not depend on the schedule.
+        """
+        nodes = sorted(
+            self._dependencies,
+            key=lambda node: (self._packages[node >> _RANK_BITS][0], -(node & _RANK_MASK)),
+        )
+        result = {}
+        for node in nodes:
+            package, index, _, _ = self._packages[node >> _RANK_BITS]
+            result[f"{package}=={index.versions[node & _RANK_MASK]}"] = self._dependencies[node]
+        return result
+
+    def _index_of(self, package):
+        package_id = self._package_ids.get(package)
+        if package_id is not None:
+            return self._packages[package_id][1]
+        return self._version_index(package)
+
+    def _version_index(self, package, versions=()):
+        package, _ = split_extras(package)  # An extra shares its base package's versions
+        version_index = getattr(self.projects, "version_index", None)
+        if package in self.projects:
+            if version_index is not None:
+                return version_index(package)
+            return VersionIndex(self.projects[package].keys())
+        # Unknown packages have no dependencies, index the versions asked for
+        return VersionIndex(versions)
+
+    def _package_id(self, package, index):
+        package_id = self._package_ids.get(package)
+        if package_id is None:
+            package_id = self._package_ids[package] = len(self._packages)
+            base, extras = split_extras(package)
+            self._packages.append((package, index, base, frozenset(extras)))
+        return package_id
+
+    def _push(self, node, rank, index):
+        if self.schedule == SCHEDULE_BREADTH:
+            self._queue.append(node)
+        else:
+            # Distance from the package's newest version, so every package's newest comes first
+            self._sequence += 1
+            heapq.heappush(self._queue, (len(index.versions) - 1 - rank, self._sequence, node))
+        if len(self._queue) > self.stats["peak_frontier"]:
+            self.stats["peak_frontier"] = len(self._queue)
+
+    def _pop(self):
+        if self.schedule == SCHEDULE_BREADTH:
+            return self._queue.popleft()
+        return heapq.heappop(self._queue)[2]
+
+    def _queue_versions(self, package, versions):
+        package_id = self._package_id(package, versions.index)
+        visited = self._visited.get(package_id, 0)
+        # Each package version is walked once, cycles included; most candidate sets were
+        # queued before, so only the new versions are looked at
+        new = VersionSet(versions.index, versions.bits & ~visited)
+        if not new:
+            return
+        self._visited[package_id] = visited | new.bits
+        base = package_id << _RANK_BITS
+        for rank in new.ranks():  # Newest first
+            self._push(base | rank, rank, versions.index)
+
+    def _parse(self, dep):
+        record = self._records.get(dep)
+        if record is None:
+            record = self._records[dep] = parse_dependency_record(dep)
+            self.stats["parse_calls"] += 1
+        else:
+            self.stats["parse_calls_avoided"] += 1
+        return record
+
+    def _edges(self, package, version):
+        if self._dependency_edges is not None:
+            edges = self._dependency_edges(package, version) or []
+            self.stats["parse_calls_avoided"] += len(edges)
+            return edges
+
+        package = resolve_package(package, self.projects)
+        if package is None:
+            return []
+        version_data = self.projects[package].get(version, {})
+        return [
+            self._parse(dep)  # Parse dep to get dep_package and dep_specs
+            for dep in version_data.get("dependency_packages") or []
+        ]
+
+    def _expand(self, node):
+        task = self._task(node)
+        matched = self._cached(task)
+        if matched is None:
+            matched = self._match_edges(*task)
+            self._store(task, matched)
+        self._apply(node, matched)
+
+    def _task(self, node):
+        """
+        Returns the (knowledge graph key, version, extras) to expand a node with.
+        """
+        _, index, base, extras = self._packages[node >> _RANK_BITS]
+        return base, index.versions[node & _RANK_MASK], extras
+
+    def _cached(self, task):
+        if self.cache is None:
+            return None
+        matched = self.cache.get(self._context, *task)
+        if matched is None:
+            return None
+        return [(dep_package, VersionSet(self._index_of(dep_package), bits)) for dep_package, bits in matched]
+
+    def _store(self, task, matched):
+        if self.cache is not None:
+            self.cache.put(
+                self._context, *task, [(dep_package, versions.bits) for dep_package, versions in matched]
+            )
+
+    def _match_edges(self, package, version, package_extras):
+        """
+        Returns (dependency, matching versions) for the edges of one package version that apply
+        to the environment. Without extras those are the edges that are not conditional on an
+        extra; with extras, the version of the base package itself and the edges conditional on
+        them. An edge requesting extras, e.g. on "requests[socks]", is also an edge to each of
+        those extras. Only reads the knowledge graph, so worker processes can run it.
+        """
+        matched = []
+        if package_extras:
+            # The extra is installed along with the base package at the same version
+            index = self._index_of(package)
+            rank = index.ranks.get(version)
+            if rank is not None:
+                matched.append((package, VersionSet(index, 1 << rank)))
+        edges = []
+        for dep_package, dep_specs, marker, dep_extras in self._edges(package, version):
+            wanted = frozenset() if marker is None else marker_extras(marker)
+            if package_extras:
+                if not wanted & package_extras:
+                    continue  # Walked from the base package or from another extra
+            elif wanted:
+                continue  # Walked from the extras it is conditional on
+            if marker is not None:
+                applies = self._marker_results.get((marker, package_extras))
+                if applies is None:
+                    applies = self._marker_results[(marker, package_extras)] = marker_applies(
+                        marker, self.environment, package_extras
+                    )
+                if not applies:
+                    self.stats["marker_pruned"] += 1
+                    continue
+            # Use the knowledge graph spelling, so every spelling maps to one package
+            dep_package = resolve_package(dep_package, self.projects)
+            if dep_package is None:
+                continue
+            edges.append((dep_package, dep_specs, dep_extras))
+
+        # Fetch the matching versions of every edge in one call; without version
+        # specifiers that is every version
+        queries = [(dep_package, dep_specs) for dep_package, dep_specs, _ in edges]
+        for (dep_package, _, dep_extras), matching_versions in zip(
+            edges, find_matching_versions_many(queries, self.projects)
+        ):
+            if not matching_versions:
+                self.stats["unsatisfiable_edges"] += 1
+                if not self.keep_unsatisfiable:
+                    continue  # Only include dependencies that have matching versions
+                dep_extras = ()  # The dependency alone already rules this version out
+            matched.append((dep_package, matching_versions))
+            for extra in sorted({canonicalize_name(extra) for extra in dep_extras}):
+                matched.append((extra_package(dep_package, extra), matching_versions))
+        return matched
+
+    def _apply(self, node, matched):
+        dependencies = {}  # Initialize an empty dictionary to store dependencies
+        for dep_package, matching_versions in matched:
+            dependencies[dep_package] = matching_versions
+            self._queue_versions(dep_package, matching_versions)
+
+        if self._edge_batch is not None:
+            if dependencies:
+                package, index, _, _ = self._packages[node >> _RANK_BITS]
+                package_version = f"{package}=={index.versions[node & _RANK_MASK]}"
+                self._edge_batch.extend(
+                    (package_version, dep_package, matching_versions)
+                    for dep_package, matching_versions in dependencies.items()
+                )
+        # Only keep non-empty dependencies
+        elif dependencies:
+            self._dependencies[node] = dependencies
+
+
+_worker_walk = None  # The walk whose nodes a forked worker process expands
+_WORKER_COUNTERS = ("parse_calls", "parse_calls_avoided", "marker_pruned", "unsatisfiable_edges")
+
+
+def _init_worker():
+    # SQLite connections must not be shared with the parent process
+    reopen = getattr(_worker_walk.projects, "reopen", None)
+    if reopen is not None:
+        reopen()
+
+
+def _expand_chunk(tasks):
+    walk = _worker_walk
+    before = [walk.stats[name] for name in _WORKER_COUNTERS]
+    # VersionSets travel as their bits, the parent rebuilds them over its own indexes
+    matched = [
+        [(dep_package, versions.bits) for dep_package, versions in walk._match_edges(package, version, package_extras)]
+        for package, version, package_extras in tasks
+    ]
+    return matched, [walk.stats[name] - count for name, count in zip(_WORKER_COUNTERS, before)]
+
+
+class ParallelClosureWalk(ClosureWalk):
+    """
+    `ClosureWalk` that expands wide frontiers in a pool of worker processes.
+
+    The walk proceeds frontier by frontier: the queued nodes are split into chunks, the
+    workers match their edges against the knowledge graph, and this process merges the
+    matches into the one visited set and queues the new nodes, so the result is the same
+    as a serial walk. Workers are forked and share the loaded knowledge graph copy-on-write,
+    the compiled store through its memory map. Where fork is not available the walk runs
+    serially.
+    """
+
+    def __init__(self, projects_data, stats=None, environment=None,
+                 schedule=SCHEDULE_BREADTH, frontier_sample=DEFAULT_FRONTIER_SAMPLE,
+                 workers=None, min_parallel=DEFAULT_MIN_PARALLEL, cache=None, keep_unsatisfiable=False):
+        """
+        Parameters:
+            workers (int): Worker processes; None uses one per CPU, and at most one per CPU
+                           is started.
+            min_parallel (int): Frontiers smaller than this are expanded in this process.
+
+        The other parameters are those of `ClosureWalk`.
+        """
+        super().__init__(
+            projects_data, stats, environment, schedule, frontier_sample, cache, keep_unsatisfiable
+        )
+        # Workers beyond the CPUs this process may run on only add overhead
+        self.workers = min(workers or usable_cpus(), usable_cpus())
+        self.min_parallel = min_parallel
+
+    def _expansions(self, max_steps=None):
+        if self.workers < 2 or "fork" not in multiprocessing.get_all_start_methods():
+            yield from super()._expansions(max_steps)
+            return
+
+        global _worker_walk
+        _worker_walk = self
+        pool = None
+        try:
+            steps = 0
+            while self._queue and (max_steps is None or steps < max_steps):
+                count = len(self._queue) if max_steps is None else min(len(self._queue), max_steps - steps)
+                batch = [self._pop() for _ in range(count)]
+                tasks = [self._task(node) for node in batch]
+                matched = [self._cached(task) for task in tasks]
+                missing = [position for position, node_matched in enumerate(matched) if node_matched is None]
+                if len(missing) < self.min_parallel:
+                    for position in missing:
+                        matched[position] = self._match_edges(*tasks[position])
+                else:
+                    if pool is None:
+                        # Forked once the knowledge graph is loaded, so workers inherit it
+                        pool = multiprocessing.get_context("fork").Pool(self.workers, _init_worker)
+                    expanded = self._expand_in_pool(pool, [tasks[position] for position in missing])
+                    for position, node_matched in zip(missing, expanded):
+                        matched[position] = node_matched
+                for position in missing:
+                    self._store(tasks[position], matched[position])
+                for node, node_matched in zip(batch, matched):
+                    self._apply(node, node_matched)
+                    self._count_expansion()
+                    yield
+                steps += count
+        finally:
+            _worker_walk = None
+            if pool is not None:
+                pool.terminate()
+
+    def _expand_in_pool(self, pool, tasks):
+        matched = [None] * len(tasks)
+        chunks = self._partition(tasks)
+        results = pool.map(_expand_chunk, [[tasks[position] for position in chunk] for chunk in chunks])
+        for chunk, (chunk_matched, counters) in zip(chunks, results):
+            for name, count in zip(_WORKER_COUNTERS, counters):
+                self.stats[name] += count
+            for position, node_matched in zip(chunk, chunk_matched):
+                matched[position] = [
+                    (dep_package, VersionSet(self._index_of(dep_package), bits))
+                    for dep_package, bits in node_matched
+                ]
+        return matched
+
+    def _partition(self, tasks):
+        """
+        Split tasks into chunks for the workers, as lists of positions in `tasks`.
+
+        The versions of one package mostly declare the same edges, so they are kept in one
+        chunk where they can: each worker has its own match cache, and splitting a package
+        across workers would match its edges once per worker. Only packages wider than one
+        worker's share are split, and the pieces are dealt largest first to the smallest
+        chunk, several chunks per worker to even out the load.
+        """
+        size = math.ceil(len(tasks) / self.workers)
+        groups = {}
+        for position, (package, _, _) in enumerate(tasks):
+            groups.setdefault(package, []).append(position)
+        pieces = [
+            positions[start : start + size] for positions in groups.values() for start in range(0, len(positions), size)
+        ]
+        pieces.sort(key=len, reverse=True)
+        chunks = [[] for _ in range(min(len(pieces), self.workers * 4))]
+        sizes = [(0, number) for number in range(len(chunks))]
+        for piece in pieces:
+            chunk_size, number = heapq.heappop(sizes)
+            chunks[number].extend(piece)
+            heapq.heappush(sizes, (chunk_size + len(piece), number))
+        return chunks
+
+
+def usable_cpus():
+    """
+    Returns the number of CPUs this process may run on.
+    """
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:  # Not available on every platform
+        return os.cpu_count() or 1
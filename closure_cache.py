@@ -0,0 +1,228 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+from kgraph import load_sidecar
+
+
+# Most package version expansions to keep; the least recently used are evicted beyond it
+DEFAULT_CLOSURE_CACHE_SIZE = 200000
+
+# Expansions buffered before they are written, so a long walk does not hold all of them
+_MAX_PENDING = 4096
+
+# Version of the stored expansions, bumped when their layout or the version matching
+# changes; entries written by another version are dropped
+_FORMAT = "3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS expansions (
+    context TEXT NOT NULL,
+    node TEXT NOT NULL,
+    matched TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (context, node)
+);
+CREATE INDEX IF NOT EXISTS expansions_last_used ON expansions (last_used);
+"""
+
+
+def kg_fingerprint(kg_path):
+    """
+    Returns the SHA-256 of a knowledge graph file's content.
+
+    The digest is cached next to the file as `<filename>.sha256` and recomputed whenever the
+    file's size or modification time changes, see `kgraph.load_sidecar`, so only the first
+    run after an update reads the whole file.
+
+    Parameters:
+        kg_path (str): Path to the knowledge graph file, e.g. `KGraph.kgc`.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+
+    def build():
+        digest = hashlib.sha256()
+        with open(kg_path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    return load_sidecar(kg_path, ".sha256", "sha256", build)
+
+
+class ClosureCache:
+    """
+    Persistent cache of package version expansions for one knowledge graph snapshot.
+
+    An expansion is what the closure walk derives from one package version: the dependencies
+    that apply, each with its matching versions as the bits of a `VersionSet`. It depends only
+    on the knowledge graph, the extras the package stands for, e.g. "requests[socks]", and the
+    walk context (target environment, pre-release policy and the handling
+    of dependencies without matching versions), so it is
+    stored under those. The cache is a SQLite file next to the knowledge graph; when the
+    graph's content hash changes, every entry is dropped.
+    """
+
+    def __init__(self, path, fingerprint, maxsize=DEFAULT_CLOSURE_CACHE_SIZE, generation=None):
+        """
+        Parameters:
+            path (str): Path of the cache database.
+            fingerprint (str): Content hash of the knowledge graph, see `kg_fingerprint`.
+            maxsize (int): Most expansions to keep; the least recently used are evicted.
+            generation (int): Generation of a compiled store, see `kgraph.merge_delta`, recorded
+                              along with the fingerprint.
+        """
+        self.path = path
+        self.maxsize = maxsize
+        self.generation = generation
+        self.previous_generation = None  # Generation the dropped entries were built from
+        self.emptied = False  # Whether opening dropped the entries of another graph
+        self.hits = 0
+        self.misses = 0
+        self._pending = {}  # (context, node) -> matched, written on flush
+        self._loaded = {}  # Context -> {node: (rowid, matched as JSON)}, read in one query
+        self._used = set()  # Rowids read since the last flush, whose last use is refreshed
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(_SCHEMA)
+        meta = dict(self._connection.execute("SELECT key, value FROM meta"))
+        if meta.get("fingerprint") != fingerprint or meta.get("format") != _FORMAT:
+            # Even after a merged delta, `changed_packages` is not enough to keep the rest:
+            # a package that gains a release shifts its version ranks, so the stored bits of
+            # every version depending on it change as well, and those dependents reach far
+            # beyond the changed packages
+            self.emptied = bool(self._connection.execute("SELECT 1 FROM expansions LIMIT 1").fetchone())
+            if "generation" in meta:
+                self.previous_generation = int(meta["generation"])
+            with self._connection:
+                self._connection.execute("DELETE FROM expansions")
+                self._connection.execute("DELETE FROM meta WHERE key = 'generation'")
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO meta VALUES (?, ?)", [("fingerprint", fingerprint), ("format", _FORMAT)]
+                )
+        if generation is not None:
+            with self._connection:
+                self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (str(generation),))
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM expansions").fetchone()[0] + len(self._pending)
+
+    @staticmethod
+    def context_key(environment, prereleases, keep_unsatisfiable=False):
+        """
+        Returns the key of a walk context: a target environment, a pre-release policy and
+        whether dependencies without matching versions are kept.
+        """
+        return json.dumps([environment, prereleases, keep_unsatisfiable], sort_keys=True)
+
+    @staticmethod
+    def _node_key(package, version, extras):
+        return f"{package}[{','.join(sorted(extras))}]=={version}"
+
+    def get(self, context, package, version, extras):
+        """
+        Returns the cached expansion as [(dependency, bits)], or None.
+        """
+        node = self._node_key(package, version, extras)
+        matched = self._pending.get((context, node))
+        if matched is None:
+            loaded = self._loaded.get(context)
+            if loaded is None:
+                # A walk looks up thousands of nodes, one query per node would dominate it
+                loaded = self._loaded[context] = {
+                    row_node: (rowid, row_matched)
+                    for rowid, row_node, row_matched in self._connection.execute(
+                        "SELECT rowid, node, matched FROM expansions WHERE context = ?", (context,)
+                    )
+                }
+            row = loaded.get(node)
+            if row is None:
+                self.misses += 1
+                return None
+            rowid, matched = row
+            matched = [(dep_package, bits) for dep_package, bits in json.loads(matched)]
+            self._used.add(rowid)
+        self.hits += 1
+        return matched
+
+    def put(self, context, package, version, extras, matched):
+        """
+        Stores the expansion of a package version, [(dependency, bits)]. Writes are
+        buffered until `flush`, or until `_MAX_PENDING` expansions are waiting.
+        """
+        self._pending[(context, self._node_key(package, version, extras))] = matched
+        if len(self._pending) >= _MAX_PENDING:
+            # Written entries are not added to `_loaded`, which is fine, because a walk
+            # expands each node once and so never looks them up again
+            self._write_pending()
+
+    def _write_pending(self):
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO expansions VALUES (?, ?, ?, ?)",
+                (
+                    (context, node, json.dumps(matched), now)
+                    for (context, node), matched in self._pending.items()
+                ),
+            )
+        self._pending.clear()
+
+    def flush(self):
+        """
+        Writes buffered expansions, refreshes the last use of those read, and evicts the least
+        recently used entries beyond `maxsize`.
+        """
+        self._write_pending()
+        now = time.time()
+        with self._connection:
+            used = sorted(self._used)
+            for start in range(0, len(used), 500):  # Stay below SQLite's bound parameter limit
+                chunk = used[start : start + 500]
+                self._connection.execute(
+                    f"UPDATE expansions SET last_used = ? WHERE rowid IN ({','.join('?' * len(chunk))})",
+                    [now] + chunk,
+                )
+            if self.maxsize is not None:
+                excess = self._connection.execute("SELECT COUNT(*) FROM expansions").fetchone()[0] - self.maxsize
+                if excess > 0:
+                    self._connection.execute(
+                        "DELETE FROM expansions WHERE rowid IN "
+                        "(SELECT rowid FROM expansions ORDER BY last_used LIMIT ?)",
+                        (excess,),
+                    )
+        self._loaded.clear()
+        self._used.clear()
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+
+def open_closure_cache(projects, maxsize=DEFAULT_CLOSURE_CACHE_SIZE):
+    """
+    Open the closure cache of the knowledge graph a projects mapping was read from.
+
+    Parameters:
+        projects (LazyProjects): The `projects` mapping returned by `read_kgraph`.
+        maxsize (int): Most expansions to keep.
+
+    Returns:
+        ClosureCache: The cache stored as `<knowledge graph file>.closure-cache`, or None when
+                      the mapping has no backing file or the cache cannot be opened.
+    """
+    kg_path = getattr(projects, "path", None)
+    if kg_path is None:
+        return None
+    try:
+        return ClosureCache(
+            kg_path + ".closure-cache", kg_fingerprint(kg_path), maxsize, getattr(projects, "generation", None)
+        )
+    except (OSError, sqlite3.Error):
+        return None
@@ -1,55 +1,250 @@
 import re
+from collections import namedtuple
+
+from packaging.markers import InvalidMarker, Marker, UndefinedComparison, UndefinedEnvironmentName, default_environment
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import canonicalize_name
+
+from version_order import PRERELEASES_EXPLICIT, VersionIndex
+
+
+# A dependency string broken into its parts, e.g. "requests[socks]>=2.0; python_version < '3'"
+# becomes DependencyRecord("requests", ((">=", "2.0"),), 'python_version < "3"', ("socks",)).
+DependencyRecord = namedtuple("DependencyRecord", ["name", "specs", "marker", "extras"])
+
+# sys.platform values mapped to the platform_system and os_name markers that go with them
+_PLATFORMS = {
+    "linux": ("Linux", "posix"),
+    "win32": ("Windows", "nt"),
+    "cygwin": ("CYGWIN_NT", "posix"),
+    "darwin": ("Darwin", "posix"),
+}
+_IMPLEMENTATIONS = {"cpython": "CPython", "pypy": "PyPy", "ironpython": "IronPython", "jython": "Jython"}
+
+_markers = {}  # Marker strings repeat across edges, parse each one once
+_marker_extras = {}
+
+_EXTRA_CLAUSE = re.compile(r"""\bextra\s*==\s*(["'])(.*?)\1|(["'])(.*?)\3\s*==\s*extra\b""")
 
 
 def version_satisfies(version, spec):
 
-    operator, spec_version = spec
-    if operator == "==":
-        return re.match(spec_version.replace("*", ".*"), version) is not None
-    elif operator == "!=":
-        return re.match(spec_version.replace("*", ".*"), version) is None
-    elif operator == ">":
-        return version > spec_version
-    elif operator == ">=":
-        return version >= spec_version
-    elif operator == "<":
-        return version < spec_version
-    elif operator == "<=":
-        return version <= spec_version
-    return False
+    # Versions compare in PEP 440 order, so "10.0" > "9.0"; see version_order.VersionIndex
+    return VersionIndex((version,)).satisfies(version, (spec,))
+
+
+def marker_environment(python_version=None, platform=None, implementation=None):
+    """
+    Build the target environment that dependency markers are evaluated against.
+
+    Parameters:
+        python_version (str): Target Python version, e.g. "3.8" or "3.8.10".
+        platform (str): Target `sys.platform`, e.g. "linux", "win32" or "darwin".
+        implementation (str): Target implementation name, e.g. "cpython" or "pypy".
+
+    Returns:
+        dict: The marker variables of the running interpreter with the given values
+              overridden, or None when no value is given and markers are not evaluated.
+    """
+    if python_version is None and platform is None and implementation is None:
+        return None
+    environment = default_environment()
+    if implementation is not None:
+        environment["implementation_name"] = implementation.lower()
+        environment["platform_python_implementation"] = _IMPLEMENTATIONS.get(
+            implementation.lower(), implementation
+        )
+    if python_version is not None:
+        release = python_version.split(".")
+        environment["python_version"] = ".".join(release[:2])
+        environment["python_full_version"] = python_version if len(release) > 2 else python_version + ".0"
+        if environment["implementation_name"] == "cpython":
+            environment["implementation_version"] = environment["python_full_version"]
+    if platform is not None:
+        environment["sys_platform"] = platform
+        environment["platform_system"], environment["os_name"] = _PLATFORMS.get(
+            platform, (platform.capitalize(), "posix")
+        )
+    return environment
+
+
+def marker_extras(marker):
+    """
+    Returns the normalized extras a marker is conditional on, e.g. {"socks"} for
+    'extra == "socks"', or an empty frozenset when it does not mention `extra`.
+    """
+    extras = _marker_extras.get(marker)
+    if extras is None:
+        extras = _marker_extras[marker] = frozenset(
+            canonicalize_name(match.group(2) if match.group(1) else match.group(4))
+            for match in _EXTRA_CLAUSE.finditer(marker)
+        )
+    return extras
+
+
+def marker_applies(marker, environment, extras=frozenset()):
+    """
+    Check whether a dependency's environment marker holds in the target environment.
+
+    Parameters:
+        marker (str): The marker, e.g. 'python_version < "3"', or None.
+        environment (dict): The environment from `marker_environment`, or None.
+        extras (frozenset): Normalized extras requested for the package declaring the
+                            dependency. A marker conditional on extras only holds when
+                            one of them was requested.
+
+    Returns:
+        bool: False only when the marker evaluates to false; edges without a marker, or
+              with one that cannot be parsed or evaluated, are kept. Without an
+              environment, only the extras part of a marker is checked.
+    """
+    if marker is None:
+        return True
+    wanted = marker_extras(marker)
+    if wanted:
+        wanted = wanted & extras
+        if not wanted:
+            return False
+        if environment is None:
+            return True
+        return any(_evaluate(marker, dict(environment, extra=extra)) for extra in sorted(wanted))
+    if environment is None:
+        return True
+    return _evaluate(marker, environment)
+
+
+def _evaluate(marker, environment):
+    parsed = _markers.get(marker)
+    if parsed is None:
+        try:
+            parsed = Marker(marker)
+        except InvalidMarker:
+            parsed = False
+        _markers[marker] = parsed
+    if parsed is False:
+        return True
+    try:
+        return parsed.evaluate(environment)
+    except (UndefinedComparison, UndefinedEnvironmentName):
+        return True
+
+
+def resolve_package(package, projects_data):
+    """
+    Resolve a package name to the key it has in the knowledge graph.
+
+    Parameters:
+        package (str): The package name in any spelling, e.g. "SQLAlchemy" or "ruamel-yaml".
+        projects_data (dict): The `projects` mapping of the knowledge graph.
+
+    Returns:
+        str: The knowledge graph key of the package, or None if it is not in the graph.
+    """
+    # Knowledge graph mappings carry a PEP 503 name index built at load time
+    canonical = getattr(projects_data, "canonical", None)
+    if canonical is not None:
+        return canonical(package)
+    # Plain dictionaries have no index; try the name as written, then lowercased
+    for name in (package, package.lower()):
+        if name in projects_data:
+            return name
+    return None
 
 
 def find_matching_versions(package, specs, projects_data):
+    """
+    Returns the versions of `package` that satisfy every (operator, version) spec as a
+    `VersionSet`, which iterates newest first in PEP 440 order. With no specs, every
+    version of the package is returned. Pre-releases only match when a specifier names
+    one or nothing else matches, unless the store's `prerelease_policy` says otherwise.
+    """
+    # Knowledge graph mappings keep a sorted version index per package
+    query = getattr(projects_data, "find_matching_versions", None)
+    if query is not None:
+        return query(package, specs)
 
-    if package not in projects_data:
+    package = resolve_package(package, projects_data)
+    if package is None:
         return []
+    return VersionIndex(projects_data[package].keys()).match_set(specs, PRERELEASES_EXPLICIT)
 
-    versions = projects_data[package].keys()  # Get all versions of the package
-    matching_versions = []
-    for version in versions:
-        if all(version_satisfies(version, spec) for spec in specs):
-            matching_versions.append(version)  # Add version if it satisfies all specs
-    return matching_versions
 
+def find_matching_versions_many(queries, projects_data):
+    """
+    Like `find_matching_versions` for a list of (package, specs) queries, e.g. the edges
+    of one package version, matched in one call where the store supports it.
 
-def fetch_direct_dependencies(requirements, projects_data):
+    Returns:
+        list: The matching versions of each query, in the same order.
+    """
+    query = getattr(projects_data, "find_matching_versions_many", None)
+    if query is not None:
+        return query(queries)
+    return [find_matching_versions(package, specs, projects_data) for package, specs in queries]
 
+
+def fetch_direct_dependencies(requirements, projects_data, extras=None):
+    """
+    Match the requirements against the knowledge graph.
+
+    Parameters:
+        requirements (dict): Package -> version specifiers, from `requirements.parse_requirements`.
+        projects_data (dict): A dictionary containing project data, including available versions and their dependencies.
+        extras (dict): Optional package -> extras requested for it, from `requirements.parse_requirements`.
+                       Each extra is a direct dependency of its own, see `extra_package`.
+
+    Returns:
+        dict: A dictionary of direct dependencies where keys are package names and values are lists of versions.
+    """
     direct_dependencies = {}
 
     for package, specs in requirements.items():
         matching_versions = find_matching_versions(
             package, specs, projects_data["projects"]
         )
-        direct_dependencies[package] = (
+        # Key packages by their knowledge graph spelling so they meet their transitive uses
+        package = resolve_package(package, projects_data["projects"]) or package
+        direct_dependencies[package] = list(
             matching_versions  # Store matching versions for the package
         )
 
+    for package, package_extras in (extras or {}).items():
+        package = resolve_package(package, projects_data["projects"]) or package
+        for extra in sorted({canonicalize_name(extra) for extra in package_extras}):
+            direct_dependencies[extra_package(package, extra)] = list(direct_dependencies[package])
+
     return direct_dependencies
 
 
+def parse_dependency_record(dependency):
+    """
+    Parse a PEP 508 dependency string into a structured record.
+
+    Parameters:
+        dependency (str): A string such as "urllib3<3,>=1.21.1" or "pysocks!=1.5.7; extra == 'socks'".
+
+    Returns:
+        DependencyRecord: The package name, a tuple of (operator, version) specifiers,
+                          the environment marker as a string (or None) and a tuple of extras.
+    """
+    try:
+        requirement = Requirement(dependency)
+    except InvalidRequirement:
+        # Fall back to the lenient parser for strings that are not valid PEP 508
+        package, version_specs = _parse_dependency_legacy(dependency)
+        package, extras = split_extras(package)
+        marker = dependency.split(";", 1)[1].strip() if ";" in dependency else None
+        return DependencyRecord(package, tuple(version_specs), marker or None, extras)
+    version_specs = tuple(sorted((spec.operator, spec.version) for spec in requirement.specifier))
+    marker = str(requirement.marker) if requirement.marker is not None else None
+    return DependencyRecord(requirement.name, version_specs, marker, tuple(sorted(requirement.extras)))
+
+
 def parse_dependency(dependency):
     """
     Parse a dependency string into a package and a list of version specifiers.
+    Extras such as "[socks]" are not part of the returned name; `parse_dependency_record`
+    returns them.
 
     Parameters:
         dependency (str): A string representing a package and its version specifiers.
@@ -57,6 +252,32 @@ def parse_dependency(dependency):
     Returns:
         tuple: A tuple where the first element is the package name and the second element is a list of tuples representing version specifiers.
     """
+    record = parse_dependency_record(dependency)
+    return record.name, list(record.specs)
+
+
+def extra_package(package, extra):
+    """
+    Returns the name the solver knows an extra of a package by, e.g. "requests[socks]". Its
+    versions are those of the package; each depends on the package at the same version and
+    on the dependencies conditional on the extra, so those only apply when a package that
+    requests the extra is installed.
+    """
+    return f"{package}[{extra}]"
+
+
+def split_extras(name):
+    """
+    Split a requirement name such as "requests[socks, security]" into the package name
+    and a sorted tuple of its extras.
+    """
+    package, _, extras = name.partition("[")
+    extras = extras.partition("]")[0]
+    extras = tuple(sorted({extra.strip() for extra in extras.split(",") if extra.strip()}))
+    return package.strip(), extras
+
+
+def _parse_dependency_legacy(dependency):
     # Split the dependency string into parts based on version specifiers using a regular expression
     parts = re.split(r"([><!=]=?[\d.*]+(?:, )?)", dependency)
     # Extract the package name from the first part, handling extra parts after a semicolon
@@ -77,96 +298,107 @@ def parse_dependency(dependency):
     return package, version_specs  # Return the package and version_specs
 
 #original
-def fetch_transitive_dependencies(direct_dependencies, projects_data):
+def fetch_transitive_dependencies(
+    direct_dependencies,
+    projects_data,
+    stats=None,
+    environment=None,
+    schedule="breadth",
+    workers=1,
+    cache=None,
+    keep_unsatisfiable=False,
+):
     """
-    Recursively fetch transitive dependencies for each version of the packages in direct dependencies.
+    Fetch transitive dependencies for each version of the packages in direct dependencies.
 
     Parameters:
         direct_dependencies (dict): A dictionary of direct dependencies where keys are package names and values are lists of versions.
         projects_data (dict): A dictionary containing project data, including available versions and their dependencies.
+        stats (dict): Optional dictionary that receives "parse_calls", the dependency strings parsed during
+                      the walk, "parse_calls_avoided", the edges that were visited without parsing,
+                      "marker_pruned", the edges skipped because their marker is false in the
+                      target environment, "unsatisfiable_edges", the
+                      edges no version of their package satisfies, and the worklist counters of
+                      `closure.ClosureWalk`.
+        environment (dict): Optional target environment from `marker_environment`. Edges whose marker
+                            is false in it are not walked; without it only extras are checked. Edges
+                            conditional on an extra belong to the package of the extra, e.g.
+                            "requests[socks]", see `extra_package`.
+        schedule (str): Order the worklist is expanded in, "breadth" or "newest"; the result is the same.
+        workers (int): Worker processes that expand wide frontiers in parallel; None uses one per
+                       CPU and 1 walks in this process only. The result is the same.
+        cache (ClosureCache): Optional persistent cache of package version expansions, see
+                              `closure_cache.open_closure_cache`.
+        keep_unsatisfiable (bool): Keep dependencies no version satisfies as empty candidate sets,
+                                   which rules out the versions that have them, instead of
+                                   dropping the edge.
 
     Returns:
         dict: A dictionary where keys are package versions and values are dictionaries of transitive dependencies.
     """
-    transitive_dependencies = (
-        {}
-    )  # Initialize an empty dictionary to store transitive dependencies
+    walk = _closure_walk(
+        direct_dependencies, projects_data, stats, environment, schedule, workers, cache, keep_unsatisfiable
+    )
+    walk.run()
+    return walk.result()  # Return the transitive dependencies dictionary
+
+
+def stream_transitive_dependencies(
+    direct_dependencies,
+    projects_data,
+    stats=None,
+    environment=None,
+    schedule="breadth",
+    workers=1,
+    cache=None,
+    keep_unsatisfiable=False,
+    batch_size=None,
+):
+    """
+    Walk the transitive dependencies like `fetch_transitive_dependencies`, but yield them as
+    batches of edges instead of building the whole dictionary.
 
-    def _fetch(package, version):
-        key = f"{package}=={version}"  # Create a key as "package==version"
-        if (
-            key in transitive_dependencies
-        ):  # If the key is already in transitive_dependencies, return the stored value
-            return transitive_dependencies[key]
+    Each edge is ("package==version", dependency, matching versions). The parameters are those
+    of `fetch_transitive_dependencies`, plus `batch_size`, the edges per batch; None uses
+    `closure.DEFAULT_EDGE_BATCH`. The counters in `stats` are complete once the last batch
+    has been consumed.
 
-        # Handle case sensitivity for package lookup
-        version_data = projects_data["projects"].get(package, {}).get(version, {})
-        if (
-            not version_data
-        ):  # If version_data is empty, try lowercase version of the package name
-            version_data = (
-                projects_data["projects"].get(package.lower(), {}).get(version, {})
-            )
-
-        dependencies = {}  # Initialize an empty dictionary to store dependencies
-        if version_data.get(
-            "dependency_packages"
-        ):  # If version_data contains dependency_packages
-            for dep in version_data["dependency_packages"]:
-                dep_package, dep_specs = parse_dependency(
-                    dep
-                )  # Parse dep to get dep_package and dep_specs
-
-                # Handle case sensitivity for dependency package lookup
-                matching_versions = []
-                if (
-                    not dep_specs
-                ):  # If no version specifiers are provided, fetch all versions of the dependency package
-                    matching_versions = list(
-                        projects_data["projects"].get(dep_package, {}).keys()
-                    )
-                    if (
-                        not matching_versions
-                    ):  # Try lowercase version of the dependency package name if no versions found
-                        matching_versions = list(
-                            projects_data["projects"]
-                            .get(dep_package.lower(), {})
-                            .keys()
-                        )
-                else:  # If there are version specifiers, fetch matching versions of the dependency package
-                    matching_versions = find_matching_versions(
-                        dep_package, dep_specs, projects_data["projects"]
-                    )
-
-                if (
-                    matching_versions
-                ):  # Only include dependencies that have matching versions
-                    dependencies[dep_package] = (
-                        matching_versions  # Add dep_package with matching versions to dependencies
-                    )
-                    for (
-                        dep_version
-                    ) in (
-                        matching_versions
-                    ):  # Recursively fetch dependencies for each matching version
-                        _fetch(dep_package, dep_version)
-
-        # Only assign non-empty dependencies to transitive_dependencies
-        if dependencies:
-            transitive_dependencies[key] = dependencies
-
-        return dependencies  # Return the dependencies for this package and version
-
-    for (
-        package,
-        versions,
-    ) in direct_dependencies.items():  # Iterate through direct dependencies
-        for version in versions:  # Iterate through each version of the package
-            _fetch(
-                package, version
-            )  # Fetch transitive dependencies for the package and version
-
-    return transitive_dependencies  # Return the transitive dependencies dictionary
+    Yields:
+        list: A batch of edges.
+    """
+    from closure import DEFAULT_EDGE_BATCH
+
+    walk = _closure_walk(
+        direct_dependencies, projects_data, stats, environment, schedule, workers, cache, keep_unsatisfiable
+    )
+    yield from walk.edges(batch_size or DEFAULT_EDGE_BATCH)
+
+
+def _closure_walk(
+    direct_dependencies, projects_data, stats, environment, schedule, workers, cache, keep_unsatisfiable
+):
+    """
+    Returns a closure walk with the direct dependencies queued as its roots.
+    """
+    from closure import ClosureWalk, ParallelClosureWalk  # closure builds on this module
+
+    if workers == 1:
+        walk = ClosureWalk(
+            projects_data, stats, environment, schedule, cache=cache, keep_unsatisfiable=keep_unsatisfiable
+        )
+    else:
+        walk = ParallelClosureWalk(
+            projects_data,
+            stats,
+            environment,
+            schedule,
+            workers=workers,
+            cache=cache,
+            keep_unsatisfiable=keep_unsatisfiable,
+        )
+    for package, versions in direct_dependencies.items():  # Iterate through direct dependencies
+        walk.add(package, versions)
+    return walk
 
 
 #with counting the depth
@@ -203,10 +435,11 @@ def fetch_transitive_dependencies_with_depth(direct_dependencies, projects_data)
         # Add to visited versions
         visited_versions.add((package, version))
 
-        # Fetch version data, handling case sensitivity
-        version_data = projects_data["projects"].get(package, {}).get(version, {})
-        if not version_data:
-            version_data = projects_data["projects"].get(package.lower(), {}).get(version, {})
+        # Fetch version data under the package's knowledge graph spelling
+        version_data = {}
+        package_key = resolve_package(package, projects_data["projects"])
+        if package_key is not None:
+            version_data = projects_data["projects"][package_key].get(version, {})
 
         # Initialize dependencies for this package version
         dependencies = {}
@@ -214,15 +447,12 @@ def fetch_transitive_dependencies_with_depth(direct_dependencies, projects_data)
         if version_data.get("dependency_packages"):
             for dep in version_data["dependency_packages"]:
                 dep_package, dep_specs = parse_dependency(dep)
+                dep_package = resolve_package(dep_package, projects_data["projects"])
+                if dep_package is None:
+                    continue
 
                 # Fetch matching versions for the dependency
-                matching_versions = []
-                if not dep_specs:
-                    matching_versions = list(projects_data["projects"].get(dep_package, {}).keys())
-                    if not matching_versions:
-                        matching_versions = list(projects_data["projects"].get(dep_package.lower(), {}).keys())
-                else:
-                    matching_versions = find_matching_versions(dep_package, dep_specs, projects_data["projects"])
+                matching_versions = find_matching_versions(dep_package, dep_specs, projects_data["projects"])
 
                 if matching_versions:
                     dependencies[dep_package] = matching_versions
@@ -0,0 +1,105 @@
+from equivalence import candidate_masks, restrict_candidates
+from version_order import VersionSet
+
+
+def _dominates(newer, older):
+    """
+    Returns whether the version described by `newer` can replace `older` in every solution.
+
+    Each is (membership bits, {dependency: candidate bits}).
+    """
+    newer_membership, newer_dependencies = newer
+    older_membership, older_dependencies = older
+    if older_membership & ~newer_membership:
+        return False  # Some candidate set accepts the older version but not the newer one
+    for dep_package, bits in newer_dependencies.items():
+        older_bits = older_dependencies.get(dep_package)
+        if older_bits is None or older_bits & ~bits:
+            return False  # The newer version asks for something the older one does not
+    return True
+
+
+def dominated_versions(direct_dependencies, transitive_dependencies):
+    """
+    Find candidate versions that a newer candidate of the same package dominates.
+
+    A newer version B dominates an older version A when every candidate set of the package,
+    direct requirement or dependency edge, that holds A also holds B, and each dependency of
+    B is also a dependency of A with at least the candidates A allows. Replacing A by B in a
+    solution then keeps every constraint satisfied, so A never needs to be encoded. Versions
+    with identical requirements are the special case `equivalence.version_classes` handles.
+
+    Parameters:
+        direct_dependencies (dict): Package -> list of candidate versions.
+        transitive_dependencies (dict): "package==version" -> {dependency: VersionSet}.
+
+    Returns:
+        dict: Package -> {dominated version: the newer version that dominates it}.
+    """
+    return _dominated_versions(candidate_masks(direct_dependencies, transitive_dependencies), transitive_dependencies)
+
+
+def _dominated_versions(candidates, transitive_dependencies):
+    dominated = {}
+    for package, (index, masks) in candidates.items():
+        membership = {}
+        for position, mask in enumerate(masks):
+            for rank in VersionSet(index, mask).ranks():
+                membership[rank] = membership.get(rank, 0) | (1 << position)
+
+        kept = []  # Undominated versions so far, newest first; dominance is transitive
+        for rank in sorted(membership, reverse=True):
+            version = index.versions[rank]
+            dependencies = transitive_dependencies.get(f"{package}=={version}", {})
+            description = (membership[rank], {dep_package: versions.bits for dep_package, versions in dependencies.items()})
+            for newer_version, newer in kept:
+                if _dominates(newer, description):
+                    dominated.setdefault(package, {})[version] = newer_version
+                    break
+            else:
+                kept.append((version, description))
+    return dominated
+
+
+def prune_dominated(direct_dependencies, transitive_dependencies, stats=None):
+    """
+    Drop dominated candidate versions, see `dominated_versions`, until none are left.
+
+    Dropping a version removes its dependency clauses, which can make versions of its
+    dependencies dominated in turn, so the search repeats until nothing changes. The pruned
+    problem has a solution exactly when the original one does.
+
+    Parameters:
+        direct_dependencies (dict): Package -> list of candidate versions.
+        transitive_dependencies (dict): "package==version" -> {dependency: VersionSet}.
+        stats (dict): Optional dictionary that receives "versions_dropped" and "clauses_removed",
+                      the dependency edges no longer encoded.
+
+    Returns:
+        tuple: (direct_dependencies, transitive_dependencies, dominated) of the pruned problem,
+               where dominated maps each package to {dropped version: dominating version}.
+    """
+    clauses_before = sum(len(dependencies) for dependencies in transitive_dependencies.values())
+    all_dominated = {}
+    while True:
+        candidates = candidate_masks(direct_dependencies, transitive_dependencies)
+        dominated = _dominated_versions(candidates, transitive_dependencies)
+        if not dominated:
+            break
+        keep = {}
+        for package, package_dominated in dominated.items():
+            all_dominated.setdefault(package, {}).update(package_dominated)
+            index = candidates[package][0]
+            keep[package] = index.all_versions() - VersionSet(
+                index, sum(1 << index.ranks[version] for version in package_dominated)
+            )
+        direct_dependencies, transitive_dependencies = restrict_candidates(
+            direct_dependencies, transitive_dependencies, keep
+        )
+
+    if stats is not None:
+        stats["versions_dropped"] = sum(len(package_dominated) for package_dominated in all_dominated.values())
+        stats["clauses_removed"] = clauses_before - sum(
+            len(dependencies) for dependencies in transitive_dependencies.values()
+        )
+    return direct_dependencies, transitive_dependencies, all_dominated
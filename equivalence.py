@@ -0,0 +1,167 @@
+from version_order import VersionIndex, VersionSet
+
+
+def _dependencies_key(dependencies):
+    """
+    Returns a hashable form of one version's {dependency: VersionSet}.
+    """
+    return tuple(sorted((dep_package, versions.bits) for dep_package, versions in dependencies.items()))
+
+
+def candidate_masks(direct_dependencies, transitive_dependencies):
+    """
+    Collect every candidate set of every package as bits over the package's `VersionIndex`.
+
+    Returns:
+        dict: Package -> (VersionIndex, list of distinct candidate bitmasks).
+    """
+    indexes = {}
+    masks = {}
+    for dependencies in transitive_dependencies.values():
+        for dep_package, versions in dependencies.items():
+            indexes.setdefault(dep_package, versions.index)
+            masks.setdefault(dep_package, set()).add(versions.bits)
+    for package, versions in direct_dependencies.items():
+        if not versions:
+            continue
+        index = indexes.get(package)
+        if index is None:
+            index = indexes[package] = VersionIndex(versions)
+        bits = 0
+        for version in versions:
+            bits |= 1 << index.ranks[version]
+        masks.setdefault(package, set()).add(bits)
+    return {package: (indexes[package], sorted(package_masks)) for package, package_masks in masks.items()}
+
+
+def union_bits(masks):
+    """
+    Returns the union of bitmasks, e.g. every version some candidate set of a package holds.
+    """
+    bits = 0
+    for mask in masks:
+        bits |= mask
+    return bits
+
+
+def restrict_candidates(direct_dependencies, transitive_dependencies, keep):
+    """
+    Remove candidate versions from a problem.
+
+    Versions outside `keep` are dropped from the candidate lists and candidate sets, and their
+    entries from `transitive_dependencies`, so their dependency clauses are not encoded.
+    Packages without an entry in `keep` are left as they are.
+
+    Parameters:
+        direct_dependencies (dict): Package -> list of candidate versions.
+        transitive_dependencies (dict): "package==version" -> {dependency: VersionSet}.
+        keep (dict): Package -> `VersionSet` of the versions to keep, over the index
+                     `candidate_masks` returns for the package.
+
+    Returns:
+        tuple: (direct_dependencies, transitive_dependencies) of the restricted problem.
+    """
+    restricted_sets = {}  # Equal candidate sets are built once and shared
+
+    def _restrict(package, versions):
+        kept = keep.get(package)
+        if kept is None:
+            return versions
+        key = (package, versions.bits & kept.bits)
+        restricted = restricted_sets.get(key)
+        if restricted is None:
+            restricted = restricted_sets[key] = (
+                versions if key[1] == versions.bits else VersionSet(versions.index, key[1])
+            )
+        return restricted
+
+    restricted_direct = {
+        package: versions if package not in keep else [version for version in versions if version in keep[package]]
+        for package, versions in direct_dependencies.items()
+    }
+    restricted_transitive = {}
+    for package_version, dependencies in transitive_dependencies.items():
+        package, version = package_version.split("==")
+        if package in keep and version not in keep[package]:
+            continue
+        restricted_transitive[package_version] = {
+            dep_package: _restrict(dep_package, versions) for dep_package, versions in dependencies.items()
+        }
+    return restricted_direct, restricted_transitive
+
+
+def version_classes(direct_dependencies, transitive_dependencies):
+    """
+    Group the candidate versions of each package into equivalence classes.
+
+    Two versions are equivalent when no constraint can tell them apart: they have the same
+    dependencies with the same candidate sets, and every candidate set of the package,
+    direct requirement or dependency edge, either holds both or neither. Any solution that
+    uses one of them stays a solution with the other.
+
+    Parameters:
+        direct_dependencies (dict): Package -> list of candidate versions.
+        transitive_dependencies (dict): "package==version" -> {dependency: VersionSet}.
+
+    Returns:
+        dict: Package -> {representative: [member versions, newest first]}. The representative
+              is the newest member of its class.
+    """
+    return _version_classes(candidate_masks(direct_dependencies, transitive_dependencies), transitive_dependencies)
+
+
+def _version_classes(candidates, transitive_dependencies):
+    classes = {}
+    for package, (index, masks) in candidates.items():
+        signatures = {rank: [] for rank in VersionSet(index, union_bits(masks)).ranks()}
+        for position, mask in enumerate(masks):
+            for rank in VersionSet(index, mask).ranks():
+                signatures[rank].append(position)
+
+        groups = {}
+        for rank, membership in signatures.items():  # Newest first
+            dependencies = transitive_dependencies.get(f"{package}=={index.versions[rank]}", {})
+            groups.setdefault((_dependencies_key(dependencies), tuple(membership)), []).append(rank)
+        classes[package] = {
+            index.versions[ranks[0]]: [index.versions[rank] for rank in ranks] for ranks in groups.values()
+        }
+    return classes
+
+
+def collapse_version_classes(direct_dependencies, transitive_dependencies, stats=None):
+    """
+    Keep one representative version per equivalence class, see `version_classes`.
+
+    Representatives are the newest member of their class, so a solution over the collapsed
+    problem names concrete versions and `install_script.txt` needs no rewriting. The other
+    members are dropped from the candidate lists and candidate sets, and their entries from
+    `transitive_dependencies`, so fewer `Implies` clauses reach the solver.
+
+    Parameters:
+        direct_dependencies (dict): Package -> list of candidate versions.
+        transitive_dependencies (dict): "package==version" -> {dependency: VersionSet}.
+        stats (dict): Optional dictionary that receives "versions" and "classes", the candidate
+                      versions and classes over all packages, and "clauses_before" and
+                      "clauses_after", the dependency edges encoded before and after.
+
+    Returns:
+        tuple: (direct_dependencies, transitive_dependencies, classes) of the collapsed problem.
+    """
+    candidates = candidate_masks(direct_dependencies, transitive_dependencies)
+    classes = _version_classes(candidates, transitive_dependencies)
+    representatives = {}
+    for package, package_classes in classes.items():
+        index = candidates[package][0]
+        representatives[package] = VersionSet(index, sum(1 << index.ranks[version] for version in package_classes))
+    collapsed_direct, collapsed_transitive = restrict_candidates(
+        direct_dependencies, transitive_dependencies, representatives
+    )
+
+    if stats is not None:
+        stats["versions"] = sum(
+            len(members) for package_classes in classes.values() for members in package_classes.values()
+        )
+        stats["classes"] = sum(len(package_classes) for package_classes in classes.values())
+        stats["clauses_before"] = sum(len(dependencies) for dependencies in transitive_dependencies.values())
+        stats["clauses_after"] = sum(len(dependencies) for dependencies in collapsed_transitive.values())
+    return collapsed_direct, collapsed_transitive, classes
@@ -0,0 +1,1261 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import zipfile
+from array import array
+from bisect import bisect_right
+from collections.abc import Mapping
+from types import MappingProxyType
+
+from packaging.utils import canonicalize_name
+
+from dependency import DependencyRecord, parse_dependency_record
+from version_order import (
+    PRERELEASES_EXPLICIT,
+    MatchCache,
+    VersionIndex,
+    is_prerelease,
+    normalize_specs,
+    version_key,
+)
+
+
+# File layout of a compiled knowledge graph (all integers little-endian):
+#
+#   header   magic, format version, offset of the latest segment
+#   segment  prev segment offset, generation, then (offset, count) for each section:
+#            string_offsets  uint32[n + 1]  byte offsets into string_data
+#            string_data     utf-8 bytes of every interned string
+#            packages        uint32[3]      (name sid, first version, version count)
+#            versions        uint32[4]      (version sid, first edge, edge count, FLAG_* bits);
+#                                           identical dependency lists share one edge range
+#            edges           uint32[6]      (raw sid, name sid, first spec, spec count,
+#                                           marker sid, extras sid)
+#            specs           uint32[2]      (operator sid, version sid)
+#            targets         uint32[3]      (normalized dependency name sid, first reverse
+#                                           entry, reverse entry count)
+#            reverse         uint32[2]      (version position, edge position), grouped by
+#                                           target so reverse lookups never scan the graph
+#            order           uint32[1]      per package, the positions of its versions
+#                                           relative to its first one, in PEP 440 order
+#
+# "sid" is an index into the interned string table; NO_STRING stands for a missing
+# marker or extras. Extras are stored as one comma-separated string.
+#
+# Generation 0 is the whole compiled graph. Merging a delta appends a segment holding
+# the full entries of the packages it changed, linked to the previous segment, and
+# repoints the header at it; a package is read from the newest segment that has it.
+MAGIC = b"SMTPKG"
+FORMAT_VERSION = 6
+COMPILED_FILENAME = "KGraph.kgc"
+
+# Set in a version record when its "dependency_packages" is null in the JSON.
+FLAG_NULL_DEPENDENCIES = 1
+# Set in a version record when the version is a PEP 440 pre-release.
+FLAG_PRERELEASE = 2
+NO_STRING = 0xFFFFFFFF
+
+_HEADER = struct.Struct("<6sHQ")
+_SECTIONS = (
+    "string_offsets", "string_data", "packages", "versions", "edges", "specs", "targets", "reverse", "order"
+)
+_SEGMENT = struct.Struct("<QI" + "QI" * len(_SECTIONS))
+_RECORD_WIDTHS = {"packages": 3, "versions": 4, "edges": 6, "specs": 2, "targets": 3, "reverse": 2, "order": 1}
+
+
+class _StringTable:
+    """
+    Interns strings while a knowledge graph is being compiled.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.offsets = array("I", [0])
+        self.data = bytearray()
+
+    def intern(self, value):
+        sid = self.ids.get(value)
+        if sid is None:
+            sid = len(self.ids)
+            self.ids[value] = sid
+            self.data += value.encode("utf-8")
+            self.offsets.append(len(self.data))
+        return sid
+
+
+def _pad(file):
+    # Keep every section 8-byte aligned so it can be cast without copying.
+    file.write(b"\0" * (-file.tell() % 8))
+
+
+class KGInterner:
+    """
+    Shares identical data between decoded package entries.
+
+    Dependency lists are hash-consed into one immutable tuple per distinct list, version
+    entries into one read-only mapping per distinct list, and package, version and
+    dependency strings are interned, so versions that repeat the previous release's
+    dependencies cost one reference and can be compared by identity.
+    """
+
+    def __init__(self):
+        self._lists = {}
+        self._entries = {}
+        self.lists_seen = 0
+
+    def dependency_list(self, dependencies):
+        """
+        Returns the shared tuple equal to `dependencies`, or None for a null list.
+        """
+        if dependencies is None:
+            return None
+        self.lists_seen += 1
+        key = tuple(dependencies)
+        shared = self._lists.get(key)
+        if shared is None:
+            shared = self._lists[key] = tuple(sys.intern(dependency) for dependency in key)
+        return shared
+
+    @property
+    def unique_lists(self):
+        """
+        The number of distinct dependency lists kept.
+        """
+        return len(self._lists)
+
+    def version_entry(self, dependencies):
+        """
+        Returns the shared, read-only {"dependency_packages": ...} entry for a dependency list.
+        """
+        dependencies = self.dependency_list(dependencies)
+        key = id(dependencies)  # Shared tuples (and None) are unique per content
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = MappingProxyType({"dependency_packages": dependencies})
+        return entry
+
+    def object_pairs_hook(self, pairs):
+        """
+        `json` hook that interns keys and hash-conses version entries while parsing.
+        """
+        if len(pairs) == 1 and pairs[0][0] == "dependency_packages":
+            value = pairs[0][1]
+            if value is None or isinstance(value, list):
+                return self.version_entry(value)
+        return {sys.intern(key): value for key, value in pairs}
+
+    def loads(self, raw):
+        return json.loads(raw, object_pairs_hook=self.object_pairs_hook)
+
+
+def _encode_segment(projects):
+    """
+    Encode packages into the sections of one segment.
+
+    Parameters:
+        projects (dict): Package names mapped to their versions, shaped like `KGraph.json`.
+
+    Returns:
+        dict: Section name mapped to (data, record count).
+    """
+    strings = _StringTable()
+    packages = array("I")
+    versions = array("I")
+    edges = array("I")
+    specs = array("I")
+    order = array("I")
+    parsed = {}  # Dependency strings repeat heavily, parse each one once
+    ranges = {}  # Versions with an identical dependency list share one edge range
+    dependents = {}  # Normalized dependency name -> (version position, edge position) pairs
+
+    for package, package_versions in projects.items():
+        packages.extend((strings.intern(package), len(versions) // 4, len(package_versions)))
+        version_names = list(package_versions)
+        order.extend(sorted(range(len(version_names)), key=lambda i: version_key(version_names[i])))
+        for version, version_data in package_versions.items():
+            dependencies = version_data.get("dependency_packages")
+            flags = FLAG_NULL_DEPENDENCIES if dependencies is None else 0
+            if is_prerelease(version):
+                flags |= FLAG_PRERELEASE
+            dependencies = tuple(dependencies or ())
+            position = len(versions) // 4
+            first_edge = ranges.get(dependencies)
+            if first_edge is not None:
+                versions.extend((strings.intern(version), first_edge, len(dependencies), flags))
+                for edge, dependency in enumerate(dependencies, first_edge):
+                    dependents[parsed[dependency][1]].extend((position, edge))
+                continue
+            first_edge = ranges[dependencies] = len(edges) // 6
+            versions.extend((strings.intern(version), first_edge, len(dependencies), flags))
+            for edge, dependency in enumerate(dependencies, first_edge):
+                if dependency not in parsed:
+                    record = parse_dependency_record(dependency)
+                    parsed[dependency] = (record, canonicalize_name(record.name))
+                record, target = parsed[dependency]
+                dependents.setdefault(target, array("I")).extend((position, edge))
+                edges.extend(
+                    (
+                        strings.intern(dependency),
+                        strings.intern(record.name),
+                        len(specs) // 2,
+                        len(record.specs),
+                        NO_STRING if record.marker is None else strings.intern(record.marker),
+                        strings.intern(",".join(record.extras)) if record.extras else NO_STRING,
+                    )
+                )
+                for operator, spec_version in record.specs:
+                    specs.extend((strings.intern(operator), strings.intern(spec_version)))
+
+    targets = array("I")
+    reverse = array("I")
+    for target, entries in dependents.items():
+        targets.extend((strings.intern(target), len(reverse) // 2, len(entries) // 2))
+        reverse.extend(entries)
+
+    return {
+        "string_offsets": (strings.offsets, len(strings.offsets)),
+        "string_data": (strings.data, len(strings.data)),
+        "packages": (packages, len(packages) // 3),
+        "versions": (versions, len(versions) // 4),
+        "edges": (edges, len(edges) // 6),
+        "specs": (specs, len(specs) // 2),
+        "targets": (targets, len(targets) // 3),
+        "reverse": (reverse, len(reverse) // 2),
+        "order": (order, len(order)),
+    }
+
+
+def _write_segment(file, sections, prev_offset, generation):
+    """
+    Write the sections and the segment record at the current position of `file`.
+
+    Returns:
+        int: The offset of the segment record, which the header points at.
+    """
+    layout = []
+    for name in _SECTIONS:
+        data, count = sections[name]
+        _pad(file)
+        layout.extend((file.tell(), count))
+        if sys.byteorder != "little" and isinstance(data, array):
+            data = array(data.typecode, data)
+            data.byteswap()
+        file.write(data)
+    _pad(file)
+    segment_offset = file.tell()
+    file.write(_SEGMENT.pack(prev_offset, generation, *layout))
+    return segment_offset
+
+
+def compile_kg(json_path, output_path):
+    """
+    Compile `KGraph.json` into the binary store read by `CompiledKG`.
+
+    Parameters:
+        json_path (str): Path to the knowledge graph JSON file.
+        output_path (str): Path of the compiled store to write.
+
+    Returns:
+        dict: Counts of the packages, versions and dependency edges written.
+    """
+    with open(json_path, "r") as file:
+        projects = json.load(file)["projects"]
+
+    sections = _encode_segment(projects)
+
+    # Write to a temporary file first so readers never see a half-written store
+    temp_path = output_path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0))
+        segment_offset = _write_segment(file, sections, 0, 0)
+        file.seek(0)
+        file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, segment_offset))
+    os.replace(temp_path, output_path)
+
+    return {
+        "packages": sections["packages"][1],
+        "versions": sections["versions"][1],
+        "edges": sections["edges"][1],
+    }
+
+
+def _merge_entry(entry, delta_versions):
+    """
+    Add the releases and dependency edges of a delta to one decoded package entry.
+
+    Returns:
+        bool: Whether the entry changed.
+    """
+    changed = False
+    for version, version_data in delta_versions.items():
+        additions = version_data.get("dependency_packages")
+        if version not in entry:
+            entry[version] = {"dependency_packages": None if additions is None else list(additions)}
+            changed = True
+            continue
+        existing = entry[version]["dependency_packages"] or []
+        new_edges = [dependency for dependency in additions or () if dependency not in existing]
+        if new_edges:
+            entry[version]["dependency_packages"] = existing + new_edges
+            changed = True
+    return changed
+
+
+def merge_delta(compiled_path, delta_path):
+    """
+    Apply a delta file to a compiled store in place.
+
+    A delta has the same shape as `KGraph.json` but only lists what is new: releases
+    that are not in the store yet, and dependency strings to add to existing releases.
+    Nothing is ever removed. The merged entries of the changed packages are appended as
+    a new segment and the header is repointed at it, so the store stays readable at every
+    point and readers that already have it open keep their view.
+
+    Parameters:
+        compiled_path (str): Path to the compiled store.
+        delta_path (str): Path to the delta JSON file.
+
+    Returns:
+        dict: The new generation and the names of the packages that changed. When the
+              delta adds nothing, no segment is written and the generation is unchanged.
+    """
+    with open(delta_path, "r") as file:
+        delta = json.load(file)["projects"]
+
+    kg = CompiledKG(compiled_path)
+    try:
+        spellings = kg.projects
+        merged = {}
+        for package, delta_versions in delta.items():
+            package = spellings.canonical(package) or package
+            entry = merged.get(package)
+            if entry is None:
+                entry = kg.package_entry(package) if package in kg else {}
+            if _merge_entry(entry, delta_versions):
+                merged[package] = entry
+        generation, prev_offset = kg.generation, kg.segment_offset
+    finally:
+        kg.close()
+
+    if not merged:
+        return {"generation": generation, "changed": []}
+
+    sections = _encode_segment(merged)
+    with open(compiled_path, "r+b") as file:
+        file.seek(0, os.SEEK_END)
+        _pad(file)
+        segment_offset = _write_segment(file, sections, prev_offset, generation + 1)
+        # The segment must be on disk before the header points at it
+        file.flush()
+        os.fsync(file.fileno())
+        file.seek(0)
+        file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, segment_offset))
+    return {"generation": generation + 1, "changed": list(merged)}
+
+
+class _Segment:
+    """
+    The sections of one segment of a compiled store. Generation 0 holds the whole
+    knowledge graph; every merged delta adds a segment with the packages it changed.
+    """
+
+    def __init__(self, kg, offset):
+        fields = _SEGMENT.unpack_from(kg._mm, offset)
+        self.offset = offset
+        self.prev_offset, self.generation = fields[0], fields[1]
+        sections = {}
+        for index, name in enumerate(_SECTIONS):
+            section_offset, count = fields[2 + 2 * index], fields[3 + 2 * index]
+            if name == "string_data":
+                sections[name] = (section_offset, count)
+            elif name == "string_offsets":
+                sections[name] = kg._cast(section_offset, count)
+            else:
+                sections[name] = kg._cast(section_offset, count * _RECORD_WIDTHS[name])
+
+        self._mm = kg._mm
+        self._string_offsets = sections["string_offsets"]
+        self._string_data_offset = sections["string_data"][0]
+        self.packages = sections["packages"]
+        self.versions = sections["versions"]
+        self.edges = sections["edges"]
+        self.specs = sections["specs"]
+        self.targets = sections["targets"]
+        self.reverse = sections["reverse"]
+        self.order = sections["order"]
+        self._target_ids = None
+        self._package_starts = None
+
+    def string(self, sid):
+        start = self._string_data_offset + self._string_offsets[sid]
+        end = self._string_data_offset + self._string_offsets[sid + 1]
+        return str(self._mm[start:end], "utf-8")
+
+    def package_names(self):
+        return [self.string(self.packages[3 * index]) for index in range(len(self.packages) // 3)]
+
+    def reverse_entries(self, target):
+        """
+        Returns the (version position, edge position) pairs of the edges pointing at the
+        normalized name `target`, as one flat sequence.
+        """
+        if self._target_ids is None:
+            self._target_ids = {
+                self.string(self.targets[3 * index]): index for index in range(len(self.targets) // 3)
+            }
+        index = self._target_ids.get(target)
+        if index is None:
+            return ()
+        first, count = self.targets[3 * index + 1], self.targets[3 * index + 2]
+        return self.reverse[2 * first : 2 * (first + count)]
+
+    def package_at(self, version_position):
+        """
+        Returns the index of the package owning the version record at `version_position`.
+        """
+        if self._package_starts is None:
+            self._package_starts = self.packages[1::3].tolist()
+        return bisect_right(self._package_starts, version_position) - 1
+
+
+def _edge_record(segment, edge):
+    """
+    Decode the edge record at position `edge` of `segment` into a `DependencyRecord`.
+    """
+    string, specs = segment.string, segment.specs
+    _, name_sid, first_spec, spec_count, marker_sid, extras_sid = segment.edges[6 * edge : 6 * edge + 6]
+    return DependencyRecord(
+        string(name_sid),
+        tuple(
+            (string(specs[2 * i]), string(specs[2 * i + 1]))
+            for i in range(first_spec, first_spec + spec_count)
+        ),
+        None if marker_sid == NO_STRING else string(marker_sid),
+        () if extras_sid == NO_STRING else tuple(string(extras_sid).split(",")),
+    )
+
+
+class CompiledKG:
+    """
+    Read-only view of a compiled knowledge graph, memory-mapped from disk.
+
+    Opening the store only maps the file and indexes package names; version and
+    dependency records are decoded from the mapping when a package is looked up.
+    When deltas have been merged, a package is read from the newest segment holding it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = [memoryview(self._mm)]
+
+        magic, format_version, segment_offset = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled knowledge graph")
+        if format_version != FORMAT_VERSION:
+            raise ValueError(
+                f"{path} uses format version {format_version}, expected {FORMAT_VERSION}"
+            )
+
+        # Follow the chain from the newest segment back to the base one
+        self.segment_offset = segment_offset
+        self._segments = [_Segment(self, segment_offset)]
+        while self._segments[-1].generation > 0:
+            self._segments.append(_Segment(self, self._segments[-1].prev_offset))
+        self.generation = self._segments[0].generation
+
+        self._projects = None
+        self._version_positions = {}
+        self._dependency_records = {}
+
+        # Package names are the only strings decoded up front. Newer segments are
+        # indexed last so their entries replace the older ones.
+        self._package_ids = {}
+        for segment in reversed(self._segments):
+            for index, name in enumerate(segment.package_names()):
+                self._package_ids[name] = (segment, index)
+
+    def _cast(self, offset, count):
+        words = self._views[0][offset : offset + 4 * count]
+        if sys.byteorder != "little":
+            swapped = array("I", bytes(words))
+            swapped.byteswap()
+            return swapped
+        words = words.cast("I")
+        self._views.append(words)
+        return words
+
+    def __contains__(self, package):
+        return package in self._package_ids
+
+    def package_names(self):
+        """
+        Returns:
+            list: The names of all packages in the store, in knowledge graph order.
+        """
+        return list(self._package_ids)
+
+    def changed_packages(self, since_generation=0):
+        """
+        Names of the packages changed by deltas merged after `since_generation`.
+
+        Caches derived from the store can record `generation` and later drop only the
+        entries of these packages instead of everything.
+        """
+        changed = set()
+        for segment in self._segments:
+            if segment.generation <= since_generation:
+                break
+            changed.update(segment.package_names())
+        return changed
+
+    def _version_positions_of(self, package):
+        segment, index = self._package_ids[package]
+        first, count = segment.packages[3 * index + 1], segment.packages[3 * index + 2]
+        return segment, range(first, first + count)
+
+    def versions(self, package):
+        """
+        Returns:
+            list: The version strings of `package`, in knowledge graph order.
+        """
+        segment, positions = self._version_positions_of(package)
+        return [segment.string(segment.versions[4 * position]) for position in positions]
+
+    def version_index(self, package):
+        """
+        Returns the `VersionIndex` of `package`, using the PEP 440 order stored at compile time.
+        """
+        segment, positions = self._version_positions_of(package)
+        return VersionIndex(
+            [segment.string(segment.versions[4 * position]) for position in positions],
+            segment.order[positions.start : positions.stop],
+            [segment.versions[4 * position + 3] & FLAG_PRERELEASE for position in positions],
+        )
+
+    def package_entry(self, package, interner=None):
+        """
+        Decode one package into the same structure `KGraph.json` uses.
+
+        Parameters:
+            package (str): The package name.
+            interner (KGInterner): Optional interner that shares dependency tuples and strings.
+
+        Returns:
+            dict: Version strings mapped to {"dependency_packages": list or None}.
+        """
+        segment, positions = self._version_positions_of(package)
+        entry = {}
+        shared = {}  # Versions pointing at the same edge range decode it once
+        for position in positions:
+            version_sid, first_edge, edge_count, flags = segment.versions[4 * position : 4 * position + 4]
+            version = segment.string(version_sid)
+            key = (first_edge, edge_count, flags & FLAG_NULL_DEPENDENCIES)
+            if interner is not None and key in shared:
+                entry[sys.intern(version)] = shared[key]
+                continue
+            if flags & FLAG_NULL_DEPENDENCIES:
+                dependencies = None
+            else:
+                dependencies = [
+                    segment.string(segment.edges[6 * edge])
+                    for edge in range(first_edge, first_edge + edge_count)
+                ]
+            if interner is None:
+                entry[version] = {"dependency_packages": dependencies}
+            else:
+                entry[sys.intern(version)] = shared[key] = interner.version_entry(dependencies)
+        return entry
+
+    def _version_record(self, package, version):
+        """
+        Returns the segment and version record of `package` at `version`, or None if
+        either is unknown.
+        """
+        positions = self._version_positions.get(package)
+        if positions is None:
+            if package not in self._package_ids:
+                return None
+            segment, package_positions = self._version_positions_of(package)
+            positions = self._version_positions[package] = (
+                segment,
+                {segment.string(segment.versions[4 * position]): position for position in package_positions},
+            )
+        segment, positions = positions
+        position = positions.get(version)
+        if position is None:
+            return None
+        return segment, segment.versions[4 * position : 4 * position + 4]
+
+    def dependency_edges(self, package, version):
+        """
+        Returns the pre-parsed dependencies of one package version.
+
+        Versions sharing one dependency list share one tuple of records, so no string is
+        decoded or parsed twice.
+
+        Returns:
+            tuple: `DependencyRecord`s, or None when the package version is not in the store.
+        """
+        found = self._version_record(package, version)
+        if found is None:
+            return None
+        segment, (_, first_edge, edge_count, flags) = found
+        if flags & FLAG_NULL_DEPENDENCIES:
+            return ()
+        # An empty list starts where the next version's edges do, so the count is part of the key
+        key = (segment.generation, first_edge, edge_count)
+        edges = self._dependency_records.get(key)
+        if edges is None:
+            edges = self._dependency_records[key] = tuple(
+                _edge_record(segment, edge) for edge in range(first_edge, first_edge + edge_count)
+            )
+        return edges
+
+    def reverse_dependencies(self, package):
+        """
+        Find every package version that depends on `package`, using the reverse index
+        written at compile time instead of scanning all dependency lists.
+
+        Parameters:
+            package (str): The dependency name, in any spelling.
+
+        Returns:
+            list: (package, version, DependencyRecord) tuples, in knowledge graph order.
+        """
+        target = canonicalize_name(package)
+        dependents = []
+        for segment in reversed(self._segments):
+            entries = segment.reverse_entries(target)
+            records = {}  # Edge ranges are shared, so many versions point at one edge
+            for i in range(0, len(entries), 2):
+                position, edge = entries[i], entries[i + 1]
+                index = segment.package_at(position)
+                name = segment.string(segment.packages[3 * index])
+                if self._package_ids[name] != (segment, index):
+                    continue  # Superseded by a newer segment
+                record = records.get(edge)
+                if record is None:
+                    record = records[edge] = _edge_record(segment, edge)
+                dependents.append((name, segment.string(segment.versions[4 * position]), record))
+        return dependents
+
+    @property
+    def projects(self):
+        """
+        A read-only mapping with the same shape as `projects_data["projects"]`.
+        """
+        if self._projects is None:
+            self._projects = CompiledProjects(self)
+        return self._projects
+
+    def interned_projects(self, interner=None):
+        """
+        Like `projects`, but decoding through a `KGInterner`.
+        """
+        return CompiledProjects(self, interner or KGInterner())
+
+    def close(self):
+        # Views into the mapping must be released before it can be closed
+        self._segments = []
+        for view in reversed(self._views):
+            view.release()
+        self._mm.close()
+
+
+class LazyProjects(Mapping):
+    """
+    Mapping of package name to its versions that decodes a package's entry on its
+    first lookup and keeps it for later ones. Subclasses provide `_package_index`,
+    a mapping whose keys are the package names, and `_decode`.
+    """
+
+    def __init__(self, interner=None):
+        self._decoded = {}
+        self.interner = interner
+        self._spellings = None
+        self._version_indexes = {}
+        self.match_cache = MatchCache()
+        self.prerelease_policy = PRERELEASES_EXPLICIT
+
+    def _decode(self, package):
+        raise NotImplementedError
+
+    def _build_version_index(self, package):
+        return VersionIndex(self[package].keys())
+
+    def version_index(self, package):
+        """
+        Returns the `VersionIndex` of a package, given by its knowledge graph key. It is
+        built on first use and kept for the rest of the run.
+        """
+        index = self._version_indexes.get(package)
+        if index is None:
+            index = self._version_indexes[package] = self._build_version_index(package)
+        return index
+
+    def find_matching_versions(self, package, specs):
+        """
+        Returns the versions of `package` that satisfy every (operator, version) spec,
+        as a `VersionSet` that iterates newest first. Pre-releases are admitted according to
+        `prerelease_policy`. Results are memoized in `match_cache` and shared between callers.
+        """
+        package = self.canonical(package)
+        if package is None:
+            return ()
+        key = (package, normalize_specs(specs), self.prerelease_policy)
+        matches = self.match_cache.get(key)
+        if matches is None:
+            matches = self.version_index(package).match_set(key[1], self.prerelease_policy)
+            self.match_cache.put(key, matches)
+        return matches
+
+    def find_matching_versions_many(self, queries):
+        """
+        Like `find_matching_versions` for many (package, specs) queries, e.g. every edge of
+        one package version. The queries missing from `match_cache` are grouped by package
+        and each group is matched in one `VersionIndex.match_sets` call.
+
+        Returns:
+            list: One `VersionSet` per query, in the same order; () for an unknown package.
+        """
+        results = []
+        missing = {}  # Package -> {cache key: positions in `queries`}
+        for position, (package, specs) in enumerate(queries):
+            package = self.canonical(package)
+            if package is None:
+                results.append(())
+                continue
+            key = (package, normalize_specs(specs), self.prerelease_policy)
+            matches = self.match_cache.get(key)
+            if matches is None:
+                missing.setdefault(package, {}).setdefault(key, []).append(position)
+            results.append(matches)
+        for package, keys in missing.items():
+            batch = self.version_index(package).match_sets([key[1] for key in keys], self.prerelease_policy)
+            for (key, positions), matches in zip(keys.items(), batch):
+                self.match_cache.put(key, matches)
+                for position in positions:
+                    results[position] = matches
+        return results
+
+    def _loads(self, raw):
+        # Parse one raw JSON package entry, through the interner when one is set
+        if self.interner is not None:
+            return self.interner.loads(raw)
+        return json.loads(raw)
+
+    def __getitem__(self, package):
+        entry = self._decoded.get(package)
+        if entry is None:
+            if package not in self._package_index:
+                raise KeyError(package)
+            entry = self._decoded[package] = self._decode(package)
+        return entry
+
+    def __contains__(self, package):
+        return package in self._package_index
+
+    def __iter__(self):
+        return iter(self._package_index)
+
+    def __len__(self):
+        return len(self._package_index)
+
+    @property
+    def decoded_count(self):
+        """
+        The number of packages decoded so far.
+        """
+        return len(self._decoded)
+
+    def canonical(self, name):
+        """
+        Resolve any spelling of a package name to its key in the knowledge graph.
+
+        Names are compared in their PEP 503 normalized form, so "SQLAlchemy", "sqlalchemy",
+        "ruamel.yaml" and "ruamel-yaml" each resolve to the one key the graph uses. When the
+        graph itself holds several spellings of one project, the first one wins.
+
+        Returns:
+            str: The knowledge graph key, or None if the package is unknown.
+        """
+        if self._spellings is None:
+            self._build_spellings()
+        try:
+            return self._spellings[name]
+        except KeyError:
+            package = self._spellings[name] = self._spellings.get(canonicalize_name(name))
+            return package
+
+    def _build_spellings(self):
+        # Built once per load; afterwards each lookup is a single dictionary hit
+        spellings = {}
+        for package in self._package_index:
+            spellings.setdefault(canonicalize_name(package), package)
+        for package in self._package_index:
+            spellings[package] = spellings[canonicalize_name(package)]
+        self._spellings = spellings
+
+
+class LoadedProjects(LazyProjects):
+    """
+    Adapts a fully parsed `projects` dictionary to the `LazyProjects` interface.
+    """
+
+    def __init__(self, projects):
+        super().__init__()
+        self._package_index = projects
+
+    def _decode(self, package):
+        return self._package_index[package]
+
+
+class CompiledProjects(LazyProjects):
+    """
+    Lazy mapping backed by a `CompiledKG`.
+    """
+
+    def __init__(self, kg, interner=None):
+        super().__init__(interner)
+        self.kg = kg
+        self.path = kg.path
+        self.generation = kg.generation
+        self._package_index = kg._package_ids
+
+    def _decode(self, package):
+        return self.kg.package_entry(package, self.interner)
+
+    def _build_version_index(self, package):
+        return self.kg.version_index(package)
+
+    def dependency_edges(self, package, version):
+        package = self.canonical(package)
+        if package is None:
+            return None
+        return self.kg.dependency_edges(package, version)
+
+    def reverse_dependencies(self, package):
+        return self.kg.reverse_dependencies(package)
+
+
+# Matches one `"package": {...}` member of the "projects" object. Version entries
+# are objects holding strings, arrays and nulls, so two levels of braces suffice.
+# Each repetition is written as "plain run, then (delimited part, plain run)*", so a
+# failed match backtracks linearly without the possessive quantifiers of Python 3.11.
+_JSON_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_JSON_FLAT = rb'[^{}"]*(?:' + _JSON_STRING + rb'[^{}"]*)*'
+_JSON_PROJECTS_START = re.compile(rb'\s*\{\s*"projects"\s*:\s*\{')
+_JSON_PACKAGE_MEMBER = re.compile(
+    rb"\s*(" + _JSON_STRING + rb")\s*:\s*"
+    rb"(\{[^{}\"]*(?:(?:" + _JSON_STRING + rb"|\{" + _JSON_FLAT + rb"\})[^{}\"]*)*\})\s*,?"
+)
+_JSON_PROJECTS_END = re.compile(rb"\s*\}\s*\}\s*$")
+
+
+def build_json_index(buffer):
+    """
+    Locate every package entry of a knowledge graph JSON document without parsing it.
+
+    Parameters:
+        buffer (bytes-like): The raw JSON document.
+
+    Returns:
+        dict: Package names mapped to the (start, end) byte offsets of their entry.
+    """
+    match = _JSON_PROJECTS_START.match(buffer)
+    if not match:
+        raise ValueError("knowledge graph JSON does not start with a 'projects' object")
+    position = match.end()
+    index = {}
+    while True:
+        match = _JSON_PACKAGE_MEMBER.match(buffer, position)
+        if not match:
+            break
+        index[json.loads(match.group(1))] = (match.start(2), match.end(2))
+        position = match.end()
+    if not _JSON_PROJECTS_END.match(buffer, position):
+        raise ValueError(f"unexpected knowledge graph JSON structure at byte {position}")
+    return index
+
+
+def load_sidecar(path, suffix, key, build):
+    """
+    Returns a value derived from a file, cached next to it in the JSON sidecar `<path><suffix>`.
+
+    The sidecar records the file's size and modification time with the value; when either
+    has changed, or the sidecar is missing or unreadable, the value is built again and the
+    sidecar rewritten. A sidecar that cannot be written only costs building the value again
+    next time.
+
+    Parameters:
+        path (str): Path to the file the value is derived from.
+        suffix (str): Suffix of the sidecar's file name, e.g. ".idx".
+        key (str): Name of the value in the sidecar.
+        build (callable): Builds the value from the file; it must be JSON serializable.
+
+    Returns:
+        The value, as it reads back from JSON.
+    """
+    sidecar_path = path + suffix
+    stat = os.stat(path)  # Taken before building, so a file changed meanwhile is rebuilt next time
+    try:
+        with open(sidecar_path, "r") as file:
+            cached = json.load(file)
+        if cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached[key]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    value = build()
+    try:
+        with open(sidecar_path, "w") as file:
+            json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, key: value}, file)
+    except OSError:
+        pass
+    return value
+
+
+def load_json_index(json_path):
+    """
+    Load the package offset index of a knowledge graph JSON file.
+
+    The index is cached next to the JSON file as `<filename>.idx` and rebuilt
+    whenever the JSON file's size or modification time changes, see `load_sidecar`.
+
+    Parameters:
+        json_path (str): Path to the knowledge graph JSON file.
+
+    Returns:
+        dict: Package names mapped to the (start, end) byte offsets of their entry.
+    """
+
+    def build():
+        with open(json_path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return build_json_index(buffer)
+
+    index = load_sidecar(json_path, ".idx", "packages", build)
+    return {package: tuple(span) for package, span in index.items()}
+
+
+class JsonIndexedProjects(LazyProjects):
+    """
+    Lazy mapping over a memory-mapped `KGraph.json`, using a package offset index to
+    decode only the packages that are looked up.
+    """
+
+    def __init__(self, json_path, interner=None):
+        super().__init__(interner)
+        self.path = json_path
+        self._package_index = load_json_index(json_path)
+        with open(json_path, "rb") as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _decode(self, package):
+        start, end = self._package_index[package]
+        return self._loads(self._mm[start:end])
+
+    def close(self):
+        self._mm.close()
+
+
+def iter_json_packages(stream, chunk_size=1 << 20):
+    """
+    Incrementally split a knowledge graph JSON stream into its package entries.
+
+    Only the bytes of one package entry, plus one read chunk, are held at a time.
+
+    Parameters:
+        stream (file-like): A binary stream positioned at the start of the JSON document.
+        chunk_size (int): The number of bytes to read at a time.
+
+    Yields:
+        tuple: (package name, byte offset of the entry in the stream, raw JSON bytes of the entry).
+    """
+    buffer = bytearray()
+    consumed = 0  # Stream offset of buffer[0]
+    eof = False
+
+    def fill():
+        nonlocal eof
+        # An entry larger than a chunk is matched again after every read, so the read size
+        # grows with the buffer to keep that work linear
+        chunk = stream.read(max(chunk_size, len(buffer)))
+        if chunk:
+            buffer.extend(chunk)
+        else:
+            eof = True
+
+    while not eof and not _JSON_PROJECTS_START.match(buffer):
+        fill()
+    match = _JSON_PROJECTS_START.match(buffer)
+    if not match:
+        raise ValueError("knowledge graph JSON does not start with a 'projects' object")
+    consumed += match.end()
+    del buffer[: match.end()]
+
+    while True:
+        match = _JSON_PACKAGE_MEMBER.match(buffer)
+        if match and (eof or match.end() < len(buffer)):
+            yield (
+                json.loads(match.group(1)),
+                consumed + match.start(2),
+                bytes(buffer[match.start(2) : match.end(2)]),
+            )
+            consumed += match.end()
+            del buffer[: match.end()]
+        elif not eof:
+            fill()
+        elif _JSON_PROJECTS_END.match(buffer):
+            return
+        else:
+            raise ValueError("unexpected knowledge graph JSON structure in stream")
+
+
+def read_stream_spans(stream, spans, chunk_size=1 << 20):
+    """
+    Read byte ranges from a forward-only stream in a single pass.
+
+    Parameters:
+        stream (file-like): A binary stream positioned at offset 0.
+        spans (dict): Keys mapped to (start, end) byte offsets.
+        chunk_size (int): The number of bytes to read at a time.
+
+    Yields:
+        tuple: (key, bytes of its span), in stream order. Reading stops after the last span.
+    """
+    position = 0
+    for key, (start, end) in sorted(spans.items(), key=lambda item: item[1]):
+        while position < start:
+            skipped = stream.read(min(chunk_size, start - position))
+            if not skipped:
+                raise ValueError("stream ended before the requested span")
+            position += len(skipped)
+        data = stream.read(end - start)
+        if len(data) != end - start:
+            raise ValueError("stream ended before the requested span")
+        position = end
+        yield key, data
+
+
+# Dependency lists inside a raw package entry, and the leading name of each element.
+_JSON_ARRAY = re.compile(rb"\[[^\]\"]*(?:" + _JSON_STRING + rb"[^\]\"]*)*\]")
+_JSON_DEPENDENCY_NAME = re.compile(rb'"\s*([A-Za-z0-9][A-Za-z0-9._-]*)')
+
+
+class ZipStreamProjects(LazyProjects):
+    """
+    Lazy mapping over a knowledge graph JSON file inside a zip archive.
+
+    The archive member is stream-decoded without being extracted. Only the requested
+    packages and, transitively, the packages their dependencies name are decoded. The
+    first streaming pass also records each package's byte offsets and dependency names,
+    so packages wanted later are read back in one pass that skips straight to them.
+    """
+
+    def __init__(self, zip_path, packages=(), member="KGraph.json", interner=None):
+        super().__init__(interner)
+        self.path = zip_path
+        self.member = member
+        self.passes = 0
+        self._package_index = None
+        self._dependency_names = {}
+        self._load(packages)
+
+    def _open(self):
+        archive = zipfile.ZipFile(self.path)
+        return archive, archive.open(self.member)
+
+    def _closure(self, packages):
+        """
+        Returns the normalized names reachable from `packages` through the dependency
+        names seen so far.
+        """
+        wanted = set()
+        stack = [canonicalize_name(package) for package in packages]
+        while stack:
+            name = stack.pop()
+            if name in wanted:
+                continue
+            wanted.add(name)
+            stack.extend(canonicalize_name(dep) for dep in self._dependency_names.get(name, ()))
+        return wanted
+
+    def _store(self, package, raw):
+        entry = self._decoded[package] = self._loads(raw)
+        dependencies = set()
+        for version_data in entry.values():
+            dependencies.update(version_data.get("dependency_packages") or ())
+        dependency_names = self._dependency_names[canonicalize_name(package)] = {
+            parse_dependency_record(dependency).name for dependency in dependencies
+        }
+        return dependency_names
+
+    def _scan(self, wanted):
+        """
+        First pass: index every package and decode the wanted ones as they stream by.
+        """
+        index = {}
+        archive, stream = self._open()
+        with archive, stream:
+            for package, start, raw in iter_json_packages(stream):
+                index[package] = (start, start + len(raw))
+                if canonicalize_name(package) in wanted:
+                    wanted |= self._closure(self._store(package, raw))
+                else:
+                    # Consecutive versions mostly repeat one list, scan each once
+                    dependency_names = self._dependency_names[canonicalize_name(package)] = set()
+                    for dependencies in set(_JSON_ARRAY.findall(raw)):
+                        dependency_names.update(
+                            name.decode() for name in _JSON_DEPENDENCY_NAME.findall(dependencies)
+                        )
+        self._package_index = index
+        self.passes += 1
+
+    def _load(self, packages):
+        """
+        Stream the archive until every wanted package and its dependencies are decoded.
+        """
+        wanted = self._closure(packages)
+        if self._package_index is None:
+            self._scan(wanted)
+        while True:
+            wanted = self._closure(wanted)
+            pending = {
+                package
+                for package in self._package_index
+                if package not in self._decoded and canonicalize_name(package) in wanted
+            }
+            if not pending:
+                return
+            spans = {package: self._package_index[package] for package in pending}
+            archive, stream = self._open()
+            with archive, stream:
+                for package, raw in read_stream_spans(stream, spans):
+                    wanted |= self._store(package, raw)
+            self.passes += 1
+
+    def _decode(self, package):
+        self._load([package])
+        return self._decoded[package]
+
+
+def open_compiled_kg(path):
+    """
+    Open a compiled knowledge graph.
+
+    Parameters:
+        path (str): Path to the compiled store.
+
+    Returns:
+        CompiledKG: The memory-mapped store.
+    """
+    return CompiledKG(path)
+
+
+def is_compiled_kg_fresh(compiled_path, json_path):
+    """
+    Check whether a compiled store exists and is at least as new as its JSON source.
+    """
+    if not os.path.exists(compiled_path):
+        return False
+    if not os.path.exists(json_path):
+        return True
+    return os.path.getmtime(compiled_path) >= os.path.getmtime(json_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the compiled knowledge graph.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = subparsers.add_parser(
+        "compile-kg", help="Compile KGraph.json into a memory-mappable binary store."
+    )
+    compile_parser.add_argument(
+        "-i", "--input", type=str, default="KGraph.json", help="Knowledge graph JSON file."
+    )
+    compile_parser.add_argument(
+        "-o", "--output", type=str, default=COMPILED_FILENAME, help="Compiled store to write."
+    )
+
+    sqlite_parser = subparsers.add_parser(
+        "build-sqlite", help="Load KGraph.json into an indexed SQLite database."
+    )
+    sqlite_parser.add_argument(
+        "-i", "--input", type=str, default="KGraph.json", help="Knowledge graph JSON file."
+    )
+    sqlite_parser.add_argument(
+        "-o", "--output", type=str, default="KGraph.sqlite", help="SQLite database to write."
+    )
+
+    delta_parser = subparsers.add_parser(
+        "merge-delta", help="Apply delta files to a compiled store in place."
+    )
+    delta_parser.add_argument("deltas", nargs="+", help="Delta JSON files, applied in order.")
+    delta_parser.add_argument(
+        "-s", "--store", type=str, default=COMPILED_FILENAME, help="Compiled store to update."
+    )
+
+    rdeps_parser = subparsers.add_parser(
+        "rdeps", help="List the package versions that depend on a package."
+    )
+    rdeps_parser.add_argument("package", help="The dependency to look up.")
+    rdeps_parser.add_argument(
+        "--version",
+        type=str,
+        help="Only list dependents whose specifiers reject this version of the package.",
+    )
+    rdeps_parser.add_argument(
+        "-s", "--store", type=str, default=COMPILED_FILENAME, help="Compiled store to query."
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "compile-kg":
+        counts = compile_kg(args.input, args.output)
+        print(
+            f"Compiled {counts['packages']} packages, {counts['versions']} versions and "
+            f"{counts['edges']} dependency edges into {args.output}"
+        )
+    elif args.command == "build-sqlite":
+        from kgraph_sqlite import build_sqlite_kg
+
+        counts = build_sqlite_kg(args.input, args.output)
+        print(
+            f"Loaded {counts['packages']} packages, {counts['versions']} versions and "
+            f"{counts['edges']} dependency edges into {args.output}"
+        )
+    elif args.command == "merge-delta":
+        for delta_path in args.deltas:
+            result = merge_delta(args.store, delta_path)
+            if result["changed"]:
+                print(
+                    f"{delta_path}: generation {result['generation']}, "
+                    f"{len(result['changed'])} packages changed: {', '.join(result['changed'])}"
+                )
+            else:
+                print(f"{delta_path}: nothing new, store left at generation {result['generation']}")
+    elif args.command == "rdeps":
+        from dependency import version_satisfies
+
+        kg = open_compiled_kg(args.store)
+        try:
+            dependents = kg.reverse_dependencies(args.package)
+            if args.version is not None:
+                dependents = [
+                    (package, version, record)
+                    for package, version, record in dependents
+                    if not all(version_satisfies(args.version, spec) for spec in record.specs)
+                ]
+            for package, version, record in dependents:
+                specifier = ",".join(operator + spec_version for operator, spec_version in record.specs)
+                print(f"{package}=={version}: {record.name}{specifier}")
+            print(f"{len(dependents)} dependent package versions")
+        finally:
+            kg.close()
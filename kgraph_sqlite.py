@@ -0,0 +1,234 @@
+import json
+import os
+import sqlite3
+import sys
+
+from packaging.utils import canonicalize_name
+
+from dependency import DependencyRecord, parse_dependency_record
+from kgraph import LazyProjects
+from version_order import VersionIndex
+
+
+SQLITE_FILENAME = "KGraph.sqlite"
+
+_SCHEMA = """
+CREATE TABLE packages (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    normalized_name TEXT NOT NULL
+);
+CREATE TABLE versions (
+    id INTEGER PRIMARY KEY,
+    package_id INTEGER NOT NULL REFERENCES packages (id),
+    version TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    has_dependencies INTEGER NOT NULL
+);
+CREATE TABLE dependencies (
+    id INTEGER PRIMARY KEY,
+    version_id INTEGER NOT NULL REFERENCES versions (id),
+    position INTEGER NOT NULL,
+    requirement TEXT NOT NULL,
+    target_name TEXT NOT NULL,
+    target_normalized_name TEXT NOT NULL,
+    marker TEXT,
+    extras TEXT
+);
+CREATE TABLE dependency_specs (
+    dependency_id INTEGER NOT NULL REFERENCES dependencies (id),
+    position INTEGER NOT NULL,
+    operator TEXT NOT NULL,
+    version TEXT NOT NULL
+);
+"""
+
+# Created after the bulk insert, which is much faster than maintaining them row by row
+_INDEXES = """
+CREATE INDEX packages_normalized_name ON packages (normalized_name);
+CREATE UNIQUE INDEX versions_package_version ON versions (package_id, version);
+CREATE INDEX dependencies_version ON dependencies (version_id);
+CREATE INDEX dependencies_target ON dependencies (target_normalized_name);
+CREATE INDEX dependency_specs_dependency ON dependency_specs (dependency_id);
+"""
+
+
+def build_sqlite_kg(json_path, db_path):
+    """
+    Load `KGraph.json` into a SQLite database with parsed, indexed dependency edges.
+
+    Parameters:
+        json_path (str): Path to the knowledge graph JSON file.
+        db_path (str): Path of the SQLite database to write.
+
+    Returns:
+        dict: Counts of the packages, versions and dependency edges written.
+    """
+    with open(json_path, "r") as file:
+        projects = json.load(file)["projects"]
+
+    temp_path = db_path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    counts = {"packages": 0, "versions": 0, "edges": 0}
+    try:
+        connection.executescript(_SCHEMA)
+        parsed = {}  # Dependency strings repeat heavily, parse each one once
+        version_rows, dependency_rows, spec_rows = [], [], []
+        for package_id, (package, package_versions) in enumerate(projects.items()):
+            connection.execute(
+                "INSERT INTO packages VALUES (?, ?, ?)",
+                (package_id, package, canonicalize_name(package)),
+            )
+            for position, (version, version_data) in enumerate(package_versions.items()):
+                version_id = counts["versions"]
+                counts["versions"] += 1
+                dependencies = version_data.get("dependency_packages")
+                version_rows.append((version_id, package_id, version, position, dependencies is not None))
+                for dep_position, dependency in enumerate(dependencies or []):
+                    if dependency not in parsed:
+                        parsed[dependency] = parse_dependency_record(dependency)
+                    record = parsed[dependency]
+                    dependency_id = counts["edges"]
+                    counts["edges"] += 1
+                    dependency_rows.append(
+                        (
+                            dependency_id,
+                            version_id,
+                            dep_position,
+                            dependency,
+                            record.name,
+                            canonicalize_name(record.name),
+                            record.marker,
+                            ",".join(record.extras) or None,
+                        )
+                    )
+                    spec_rows.extend(
+                        (dependency_id, spec_position, operator, spec_version)
+                        for spec_position, (operator, spec_version) in enumerate(record.specs)
+                    )
+            counts["packages"] += 1
+        connection.executemany("INSERT INTO versions VALUES (?, ?, ?, ?, ?)", version_rows)
+        connection.executemany("INSERT INTO dependencies VALUES (?, ?, ?, ?, ?, ?, ?, ?)", dependency_rows)
+        connection.executemany("INSERT INTO dependency_specs VALUES (?, ?, ?, ?)", spec_rows)
+        connection.executescript(_INDEXES)
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(temp_path, db_path)
+    return counts
+
+
+class SqliteProjects(LazyProjects):
+    """
+    Lazy mapping backed by a SQLite knowledge graph written by `build_sqlite_kg`.
+
+    Besides the mapping interface, it answers the questions the dependency walk asks,
+    the versions of a package and `dependency_edges`, with indexed queries. The database
+    is opened read-only, so several resolver processes can share one file.
+    """
+
+    def __init__(self, db_path, interner=None):
+        super().__init__(interner)
+        self.path = db_path
+        self._connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        self._package_index = dict(self._connection.execute("SELECT name, id FROM packages ORDER BY id"))
+
+    def _package_id(self, package):
+        """
+        Resolve any spelling of a package name to its id.
+        """
+        return self._package_index.get(self.canonical(package))
+
+    def _decode(self, package):
+        entry = {}
+        for version, has_dependencies, requirement in self._connection.execute(
+            """
+            SELECT v.version, v.has_dependencies, d.requirement
+            FROM versions v LEFT JOIN dependencies d ON d.version_id = v.id
+            WHERE v.package_id = ?
+            ORDER BY v.position, d.position
+            """,
+            (self._package_index[package],),
+        ):
+            version_data = entry.setdefault(
+                version, {"dependency_packages": [] if has_dependencies else None}
+            )
+            if requirement is not None:
+                version_data["dependency_packages"].append(requirement)
+        if self.interner is not None:
+            entry = {
+                sys.intern(version): self.interner.version_entry(version_data["dependency_packages"])
+                for version, version_data in entry.items()
+            }
+        return entry
+
+    def _build_version_index(self, package):
+        # Only the version column is needed, not the package's dependency lists
+        return VersionIndex(
+            version
+            for (version,) in self._connection.execute(
+                "SELECT version FROM versions WHERE package_id = ? ORDER BY position",
+                (self._package_index[package],),
+            )
+        )
+
+    def dependency_edges(self, package, version):
+        """
+        Returns the pre-parsed dependencies of one package version.
+
+        Returns:
+            list: `DependencyRecord`s, or None when the package version is not in the
+                  knowledge graph.
+        """
+        package_id = self._package_id(package)
+        row = self._connection.execute(
+            "SELECT id FROM versions WHERE package_id = ? AND version = ?", (package_id, version)
+        ).fetchone()
+        if row is None:
+            return None
+        edges = {}
+        for dependency_id, target_name, marker, extras, operator, spec_version in self._connection.execute(
+            """
+            SELECT d.id, d.target_name, d.marker, d.extras, s.operator, s.version
+            FROM dependencies d LEFT JOIN dependency_specs s ON s.dependency_id = d.id
+            WHERE d.version_id = ?
+            ORDER BY d.position, s.position
+            """,
+            row,
+        ):
+            if dependency_id not in edges:
+                edges[dependency_id] = (target_name, [], marker, tuple(extras.split(",")) if extras else ())
+            if operator is not None:
+                edges[dependency_id][1].append((operator, spec_version))
+        return [
+            DependencyRecord(name, tuple(dep_specs), marker, extras)
+            for name, dep_specs, marker, extras in edges.values()
+        ]
+
+    def reopen(self):
+        """
+        Open a fresh connection, e.g. in a forked worker process, which must not use the
+        connection it inherited.
+        """
+        self._connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def close(self):
+        self._connection.close()
+
+
+def open_sqlite_kg(db_path, interner=None):
+    """
+    Open a SQLite knowledge graph.
+
+    Parameters:
+        db_path (str): Path to the database written by `build_sqlite_kg`.
+        interner (KGInterner): Optional interner that shares dependency tuples and strings.
+
+    Returns:
+        SqliteProjects: A lazy mapping of package name to its versions.
+    """
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(db_path)
+    return SqliteProjects(db_path, interner)
@@ -0,0 +1,145 @@
+from equivalence import candidate_masks, restrict_candidates, union_bits
+from version_order import VersionSet
+
+
+def presolve(direct_dependencies, transitive_dependencies, stats=None):
+    """
+    Narrow the candidate versions by constraint propagation before the SMT stage.
+
+    Every package has a domain of versions that are still possible. Three rules are applied
+    until nothing changes:
+
+    - Arc consistency: a version with a dependency none of whose candidates is still possible
+      can never be installed, so it leaves its package's domain and every candidate set.
+    - Unit propagation: a package that must be installed, a direct requirement or a
+      dependency that every remaining version of such a package has, is narrowed to the
+      candidates its dependents allow. A domain of one version is the simplest case.
+    - The versions a required package can no longer take are dropped along with their
+      dependency clauses.
+
+    Only versions that cannot appear in any solution are removed, so the solver sees an
+    equivalent, smaller problem. If a required package loses every version the requirements
+    are unsatisfiable; the problem is then returned unchanged, so the solver reports it with
+    its proof.
+
+    Parameters:
+        direct_dependencies (dict): Package -> list of candidate versions.
+        transitive_dependencies (dict): "package==version" -> {dependency: VersionSet}.
+        stats (dict): Optional dictionary that receives "versions_removed", "clauses_removed",
+                      the dependency edges no longer encoded, "required", the packages found
+                      to be required, and "unsatisfiable".
+
+    Returns:
+        tuple: (direct_dependencies, transitive_dependencies) of the narrowed problem.
+    """
+    masks = candidate_masks(direct_dependencies, transitive_dependencies)
+    indexes = {package: index for package, (index, _) in masks.items()}
+
+    # Possible versions of each package: to begin with, every version some constraint names
+    alive = {package: union_bits(package_masks) for package, (_, package_masks) in masks.items()}
+    versions_before = sum(len(VersionSet(indexes[package], bits)) for package, bits in alive.items())
+    propagated = dict(alive)  # Domains as the dependents last saw them
+
+    # (package, rank) -> {dependency: candidate bits}, and the edges into each dependency
+    dependencies = {}
+    dependents = {}
+    for package_version, package_dependencies in transitive_dependencies.items():
+        package, version = package_version.split("==")
+        if package not in indexes:
+            continue  # Not a candidate anywhere, so never required
+        rank = indexes[package].ranks.get(version)
+        if rank is None:
+            continue  # Outside the candidate list of a direct requirement
+        dependencies[(package, rank)] = {
+            dep_package: versions.bits for dep_package, versions in package_dependencies.items()
+        }
+        for dep_package in package_dependencies:
+            dependents.setdefault(dep_package, []).append((package, rank))
+
+    required = set()
+    pending = []  # Packages whose domain shrank or that became required
+    for package, versions in direct_dependencies.items():
+        if package not in indexes:
+            continue
+        bits = 0
+        for version in versions:
+            bits |= 1 << indexes[package].ranks[version]
+        alive[package] &= bits
+        required.add(package)
+        pending.append(package)
+    # Every package is checked once; after that only those whose neighbours changed
+    pending.extend(package for package in alive if package not in required)
+
+    unsatisfiable = False
+    queued = set(pending)
+    while pending and not unsatisfiable:
+        package = pending.pop()
+        queued.discard(package)
+
+        # Arc consistency: versions of this package with an unsupported dependency die
+        for rank in VersionSet(indexes[package], alive[package]).ranks():
+            for dep_package, bits in dependencies.get((package, rank), {}).items():
+                if not bits & alive.get(dep_package, 0):
+                    alive[package] &= ~(1 << rank)
+                    break
+
+        if package in required and not alive[package]:
+            unsatisfiable = True
+            break
+
+        # Unit propagation: dependencies of every remaining version of a required package
+        # are required too, within the candidates those versions allow
+        if package in required:
+            forced = None
+            for rank in VersionSet(indexes[package], alive[package]).ranks():
+                package_dependencies = dependencies.get((package, rank), {})
+                if forced is None:
+                    forced = dict(package_dependencies)
+                else:
+                    forced = {
+                        dep_package: bits | package_dependencies[dep_package]
+                        for dep_package, bits in forced.items()
+                        if dep_package in package_dependencies
+                    }
+                if not forced:
+                    break
+            for dep_package, bits in (forced or {}).items():
+                narrowed = alive[dep_package] & bits
+                if dep_package not in required or narrowed != alive[dep_package]:
+                    required.add(dep_package)
+                    alive[dep_package] = narrowed
+                    if dep_package not in queued:
+                        queued.add(dep_package)
+                        pending.append(dep_package)
+
+        # Dependents of a package that lost versions may have lost their last candidate
+        if alive[package] != propagated[package]:
+            propagated[package] = alive[package]
+            for parent, _ in dependents.get(package, ()):
+                if parent not in queued:
+                    queued.add(parent)
+                    pending.append(parent)
+
+    if stats is not None:
+        stats["unsatisfiable"] = unsatisfiable
+        stats["required"] = len(required)
+        stats["versions_removed"] = 0
+        stats["clauses_removed"] = 0
+    if unsatisfiable:
+        return direct_dependencies, transitive_dependencies
+
+    narrowed_direct, narrowed_transitive = restrict_candidates(
+        direct_dependencies,
+        transitive_dependencies,
+        {package: VersionSet(indexes[package], bits) for package, bits in alive.items()},
+    )
+
+    if stats is not None:
+        stats["versions_removed"] = versions_before - sum(
+            len(VersionSet(indexes[package], bits)) for package, bits in alive.items()
+        )
+        stats["clauses_removed"] = sum(len(deps) for deps in transitive_dependencies.values()) - sum(
+            len(deps) for deps in narrowed_transitive.values()
+        )
+    return narrowed_direct, narrowed_transitive
+
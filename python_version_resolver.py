@@ -1,8 +1,9 @@
 import os
 import requests
 from packaging.specifiers import SpecifierSet  # To handle version constraints
-from packaging.version import Version  # To sort and compare versions
 import json
+from dependency import resolve_package
+from version_order import PRERELEASES_EXPLICIT, VersionIndex, version_key  # To sort and compare versions
 
 # Load your JSON file data into a Python dictionary
 def load_python_versions_json(json_path):
@@ -41,23 +42,34 @@ def merge_constraints(python_versions):
     
     return combined_specifier
 
-def filter_python_versions(constraints, python_versions_json):
+def filter_python_versions(constraints, python_versions_json, prereleases=PRERELEASES_EXPLICIT, python_version=None):
     """
     Filters Python versions from JSON file based on the merged constraints.
+
+    `prereleases` is the pre-release policy of the dependency walk, so e.g. 3.14.0a1 is only
+    picked when a constraint names a pre-release or nothing else matches. With a target
+    `python_version`, e.g. "3.8" or "3.8.10", only the releases of that version are kept.
     """
-    available_versions = list(python_versions_json['projects']['python'].keys())
-    
+    projects = python_versions_json['projects']
+    python = resolve_package('python', projects)
+    if hasattr(projects, 'version_index'):
+        index = projects.version_index(python)
+    else:
+        index = VersionIndex(projects[python].keys())
+
     # Filter based on the merged constraints
-    valid_versions = [version for version in available_versions if version in constraints]
+    specs = [(specifier.operator, specifier.version) for specifier in constraints]
+    if python_version is not None:
+        specs.append(("==", python_version if python_version.count(".") > 1 else python_version + ".*"))
+    valid_versions = index.match_set(specs, prereleases).ascending()  # Oldest first
     
     return valid_versions
 
 def get_latest_version(versions):
     """
-    Sorts the list of versions and returns the latest version.
+    Returns the latest version of the list, comparing cached PEP 440 sort keys.
     """
-    sorted_versions = sorted(versions, key=Version)
-    return sorted_versions[-1]
+    return max(versions, key=version_key)
 
 def collect_python_versions(requirements):
     """
@@ -68,6 +80,8 @@ def collect_python_versions(requirements):
     for requirement in requirements:
         if len(requirement) == 2:  # Ensure there are exactly two items (package_name, version)
             package_name, version = requirement
+            if "[" in package_name:
+                continue  # An extra, e.g. "requests[socks]", its package is listed on its own
             package_info = get_package_info(package_name, version)
             if package_info:
                 python_versions.append({
@@ -1,5 +1,23 @@
 import json
+import logging
 import os
+import zipfile
+
+from kgraph import (
+    COMPILED_FILENAME,
+    JsonIndexedProjects,
+    KGInterner,
+    LoadedProjects,
+    ZipStreamProjects,
+    is_compiled_kg_fresh,
+    open_compiled_kg,
+)
+from kgraph_sqlite import SQLITE_FILENAME, open_sqlite_kg
+
+
+# A fully decoded knowledge graph takes about this many times the size of its JSON in
+# memory, e.g. 374 MB for the 123 MB bundled graph with dependency lists shared
+DECODED_SIZE_FACTOR = 4
 
 def read_requirements(directory):
     """
@@ -50,16 +68,145 @@ def read_test_requirements(directory):
 
 
 # Function to read the JSON file from a directory
-def read_json_file(directory, filename="KGraph.json"):
+def read_json_file(directory, filename="KGraph.json", interner=None):
     """
     Reads the content of a JSON file from a specified directory.
 
     Parameters:
         directory (str): The path to the directory containing the JSON file.
         filename (str): The name of the JSON file to read. Default is 'updated_formated_8k.json'.
+        interner (KGInterner): Optional interner that shares identical dependency lists as
+                               tuples and interns strings while the file is parsed.
 
     Returns:
         dict: The content of the JSON file as a dictionary.
     """
     with open(os.path.join(directory, filename), "r") as file:
+        if interner is not None:
+            return json.load(file, object_pairs_hook=interner.object_pairs_hook)
         return json.load(file)
+
+
+def read_zip_file(zip_path, member="KGraph.json", interner=None):
+    """
+    Reads a JSON file from inside a zip archive in one pass, without extracting it.
+
+    Parameters:
+        zip_path (str): Path to the zip archive.
+        member (str): The name of the JSON file in the archive.
+        interner (KGInterner): Optional interner, as for `read_json_file`.
+
+    Returns:
+        dict: The content of the JSON file as a dictionary.
+    """
+    with zipfile.ZipFile(zip_path) as archive, archive.open(member) as file:
+        if interner is not None:
+            return json.load(file, object_pairs_hook=interner.object_pairs_hook)
+        return json.load(file)
+
+
+def available_memory():
+    """
+    Returns the bytes of memory that can be used without swapping, or None where the
+    platform does not report it.
+    """
+    try:
+        with open("/proc/meminfo", "r") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _zip_fits_in_memory(zip_path, member):
+    """
+    Check whether decoding the whole zipped knowledge graph leaves at least half of the
+    available memory free.
+    """
+    memory = available_memory()
+    if memory is None:
+        return False
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            size = archive.getinfo(member).file_size
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return False
+    return size * DECODED_SIZE_FACTOR <= memory // 2
+
+
+def read_kgraph(
+    directory,
+    filename="KGraph.json",
+    compiled_filename=COMPILED_FILENAME,
+    lazy=True,
+    packages=(),
+    backend="auto",
+    intern=True,
+):
+    """
+    Reads the knowledge graph from a specified directory, preferring the compiled store.
+
+    The compiled store (see `kgraph.py compile-kg`) is used when it exists and is at least
+    as new as the JSON file. Otherwise the JSON file is opened lazily through a package
+    offset index, so only the packages that are looked up get decoded; if the file cannot
+    be indexed, or `lazy` is False, it is parsed in full with `read_json_file`.
+
+    When only the zipped knowledge graph (e.g. 'KGraph.zip') is present, it is decoded in
+    full in one pass when that fits in memory, see `DECODED_SIZE_FACTOR`. Otherwise, or
+    where the available memory is unknown, it is stream-decoded in place, keeping only
+    `packages` and the packages their dependencies reach. Streaming needs a fifth of the
+    memory but about twice the time, as it splits the JSON with regular expressions and
+    reads the archive a second time for packages found late in the walk, so it is only
+    used when memory requires it.
+
+    Parameters:
+        directory (str): The path to the directory containing the knowledge graph.
+        filename (str): The name of the JSON file. Default is 'KGraph.json'.
+        compiled_filename (str): The name of the compiled store. Default is 'KGraph.kgc'.
+        lazy (bool): Whether to decode JSON packages on first access. Default is True.
+        packages (iterable): Package names to decode up front when streaming from the zip.
+        backend (str): 'auto' for the behaviour above, or 'sqlite' to query the SQLite
+                       knowledge graph (see `kgraph.py build-sqlite`) instead.
+        intern (bool): Whether identical dependency lists are shared as one tuple and
+                       strings interned while packages are decoded. Default is True.
+
+    Returns:
+        dict: The knowledge graph as {"projects": mapping of package to versions}.
+    """
+    json_path = os.path.join(directory, filename)
+    compiled_path = os.path.join(directory, compiled_filename)
+    zip_path = os.path.splitext(json_path)[0] + ".zip"
+    interner = KGInterner() if intern else None
+    if backend == "sqlite":
+        sqlite_path = os.path.join(directory, SQLITE_FILENAME)
+        logging.info(f"Using SQLite knowledge graph: {sqlite_path}")
+        return {"projects": open_sqlite_kg(sqlite_path, interner)}
+    if is_compiled_kg_fresh(compiled_path, json_path):
+        try:
+            kg = open_compiled_kg(compiled_path)
+            logging.info(f"Using compiled knowledge graph: {compiled_path}")
+            return {"projects": kg.interned_projects(interner) if intern else kg.projects}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring compiled knowledge graph {compiled_path}: {e}")
+    if not os.path.exists(json_path) and os.path.exists(zip_path):
+        if _zip_fits_in_memory(zip_path, filename):
+            projects = LoadedProjects(read_zip_file(zip_path, filename, interner)["projects"])
+            projects.path = zip_path  # Keys the closure cache, as for the streamed archive
+            logging.info(f"Read knowledge graph from {zip_path}")
+            return {"projects": projects}
+        projects = ZipStreamProjects(zip_path, packages, member=filename, interner=interner)
+        logging.info(f"Streaming knowledge graph from {zip_path}")
+        return {"projects": projects}
+    if lazy:
+        try:
+            return {"projects": JsonIndexedProjects(json_path, interner)}
+        except ValueError as e:
+            logging.warning(f"Cannot index {json_path}, reading it in full: {e}")
+    projects_data = read_json_file(directory, filename, interner)
+    projects_data["projects"] = LoadedProjects(projects_data["projects"])
+    return projects_data
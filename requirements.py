@@ -1,13 +1,18 @@
-import re
+from dependency import marker_applies, parse_dependency_record
 
 
-def parse_requirements(requirements_txt):
+def parse_requirements(requirements_txt, environment=None, extras=None):
     """
     Parses the content of requirements.txt into a dictionary of packages and their version specifiers.
-    Handles cases where version specifiers might include an "extra" part after a semicolon, and cases where there are no version specifiers.
+    Each line is parsed as a PEP 508 requirement, so versions such as 1.0.0b1 or 1.0.post1, every operator,
+    extras and environment markers are kept whole. Comments, blank lines and pip options are skipped.
 
     Parameters:
         requirements_txt (str): The content of the requirements.txt file as a single string.
+        environment (dict): Optional target environment from `dependency.marker_environment`; lines whose
+                            marker is false in it are skipped.
+        extras (dict): Optional dictionary that receives the extras requested for each package, e.g.
+                       {"requests": ["socks"]} for "requests[socks]>=2.0". Package names never include extras.
 
     Returns:
         dict: A dictionary where keys are package names and values are lists of tuples representing version specifiers.
@@ -16,37 +21,18 @@ def parse_requirements(requirements_txt):
     requirements = {}  # Initialize an empty dictionary to store package requirements
     lines = requirements_txt.strip().split("\n")  # Split the input string into lines
     for line in lines:  # Iterate through each line
-        line = line.strip()  # Trim whitespace from the line
-        if line:  # Check if the line is not empty
-            # Split the line into parts based on version specifiers using a regular expression
-            parts = re.split(r"([><!=]=?[\d.*]+(?:, )?)", line)
-            # Extract the package name from the first part, handling extra parts after a semicolon
-            package = parts[0].strip().split(";")[0].strip()
-            version_specs = parts[
-                1:
-            ]  # Extract version specifiers from the remaining parts
-
-            if not version_specs:  # If there are no version specifiers
-                requirements[package] = (
-                    []
-                )  # Add the package with an empty list of specifiers
-            else:
-                for spec in version_specs:  # Iterate through each version specifier
-                    if spec.strip():  # Trim whitespace from the specifier
-                        # Match the specifier with a regular expression to extract the operator and version
-                        match = re.match(r"([><!=]=?)([\d.*]+)", spec.strip())
-                        if match:  # If the match is successful
-                            operator, version = (
-                                match.groups()
-                            )  # Extract the operator and version
-                            if (
-                                package in requirements
-                            ):  # If the package is already in the dictionary
-                                requirements[package].append(
-                                    (operator, version)
-                                )  # Append the (operator, version) tuple to the list
-                            else:
-                                requirements[package] = [
-                                    (operator, version)
-                                ]  # Add the package with a new list containing the (operator, version) tuple
+        line = line.split(" #", 1)[0].strip()  # Drop trailing comments and whitespace
+        if not line or line.startswith(("#", "-")):  # Skip empty lines, comments and pip options
+            continue
+        # Parse the line as a PEP 508 requirement: name, extras, specifiers and marker
+        record = parse_dependency_record(line)
+        if not marker_applies(record.marker, environment):  # Skip lines for other environments
+            continue
+        package = record.name
+        if record.extras and extras is not None:
+            extras.setdefault(package, []).extend(
+                extra for extra in record.extras if extra not in extras.get(package, [])
+            )
+        # A package listed more than once must satisfy the specifiers of every line
+        requirements.setdefault(package, []).extend(record.specs)
     return requirements  # Return the dictionary of requirements
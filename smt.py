@@ -1,5 +1,6 @@
 import time
-from z3 import Optimize, String, Or, Implies, And, set_param, Solver, unsat, sat, Sum, If, Bool
+from z3 import Optimize, String, Or, Implies, And, Not, set_param, Solver, unsat, sat, Sum, If, Bool, is_implies
+from version_order import VersionSet, version_key
 
 
 # def generate_smt_expression(
@@ -86,30 +87,19 @@ from z3 import Optimize, String, Or, Implies, And, set_param, Solver, unsat, sat
 
 
 
-# with minimization function
+def _oldest_first(versions):
+    # Version sets already know their PEP 440 order; plain lists are sorted by cached keys
+    if isinstance(versions, VersionSet):
+        return versions.ascending()
+    return sorted(versions, key=version_key)
 
-def generate_smt_expression(
-    direct_dependencies, transitive_dependencies, ctx, add_soft_clauses, minimize_packages
-):
-    """
-    Generate an SMT (Satisfiability Modulo Theories) expression to handle package version constraints,
-    including both direct and transitive dependencies, using an Optimize solver.
 
-    Args:
-    direct_dependencies (dict): A dictionary where keys are package names and values are lists of matching versions.
-    transitive_dependencies (dict): A dictionary where keys are "package==version" and values are dictionaries of transitive dependencies.
-    add_soft_clauses (bool): Flag to indicate whether to add soft clauses or not.
-    minimize_packages (bool): Flag to indicate whether to minimize the number of packages included in the solution.
-
-    Returns:
-    tuple: An Optimize solver instance with the added constraints and the list of constraints.
+def _direct_constraints(solver, ctx, direct_dependencies, is_included_vars, add_soft_clauses, minimize_packages):
+    """
+    Returns the constraints that each direct dependency takes one of its candidate versions,
+    adding the inclusion and soft constraints that go with them to `solver`.
     """
-    # Initialize an Optimize solver to handle both hard and soft constraints
-    solver = Optimize(ctx=ctx)
     constraints = []
-    is_included_vars = {}  # Dictionary to store the binary inclusion variables
-
-    # Generate constraints for direct dependencies
     for package, versions in direct_dependencies.items():
         if isinstance(versions, list):
             # Create a constraint that the package version must be one of the specified versions
@@ -118,7 +108,7 @@ def generate_smt_expression(
                 continue
             package_constraint = Or(expressions)
             constraints.append(package_constraint)
-            
+
             # Create and add binary inclusion variable with the same context
             if minimize_packages:
                 is_included_vars[package] = Bool(f'is_included_{package}', ctx=ctx)
@@ -127,14 +117,130 @@ def generate_smt_expression(
 
             if add_soft_clauses:
                 # Add soft constraints with weights for versions
-                sorted_versions = sorted(
-                    versions, reverse=False
-                )  # Sort versions to prioritize newer versions
+                sorted_versions = _oldest_first(
+                    versions
+                )  # Sort versions in PEP 440 order to prioritize newer versions
                 weight = 1
                 for version in sorted_versions:
                     # Add a soft constraint with increasing weight for newer versions
                     solver.add_soft(String(package, ctx=ctx) == version, weight)
                     weight += 1  # Increment the weight for the next version
+    return constraints
+
+
+def _dependency_constraint(
+    solver, ctx, package, version, dep_package, dep_versions,
+    disjunctions, is_included_vars, add_soft_clauses, minimize_packages,
+):
+    """
+    Returns the constraint that `package==version` needs one of `dep_versions` of `dep_package`,
+    adding the inclusion and soft constraints that go with it to `solver`.
+    """
+    # Create a constraint for each dependency that it must be one of the specified versions
+    key = (dep_package, dep_versions if isinstance(dep_versions, VersionSet) else tuple(dep_versions))
+    dependency_constraint = disjunctions.get(key)
+    if dependency_constraint is None:
+        expressions = [
+            String(dep_package, ctx=ctx) == dep_version
+            for dep_version in dep_versions
+        ]
+        if len(expressions) == 0:
+            # No version satisfies the dependency (kept by the walk's
+            # keep_unsatisfiable mode), so this package version is ruled out
+            return Not(String(package, ctx=ctx) == version)
+        dependency_constraint = disjunctions[key] = Or(expressions)
+
+    # Create and add binary inclusion variable for the dependent package with the same context
+    if minimize_packages:
+        if dep_package not in is_included_vars:
+            is_included_vars[dep_package] = Bool(f'is_included_{dep_package}', ctx=ctx)
+        solver.add(Implies(is_included_vars[dep_package], dependency_constraint))
+        solver.add(Implies(dependency_constraint, is_included_vars[dep_package]))
+
+    if add_soft_clauses:
+        # Add soft constraints with weights for versions
+        sorted_versions = _oldest_first(
+            dep_versions
+        )  # Sort versions in PEP 440 order to prioritize newer versions
+        weight = 1
+        for dep_version in sorted_versions:
+            # Add a soft constraint with increasing weight for newer versions
+            solver.add_soft(
+                String(dep_package, ctx=ctx) == dep_version, weight
+            )
+            weight += 1  # Increment the weight for the next version
+
+    return Implies(String(package, ctx=ctx) == version, dependency_constraint)
+
+
+class _ExpressionWriter:
+    """
+    Writes constraints to a text file in SMT-LIB form: each package variable is declared
+    before its first use, and each constraint is an assert of its own. The candidate
+    versions of a dependency, an Or that many constraints share, are defined once with
+    `define-fun` and referred to by name afterwards. Soft clauses and the minimization
+    objective are not written.
+    """
+
+    def __init__(self, file, ctx):
+        self.file = file
+        self.ctx = ctx
+        self._declared = set()  # Package variables already declared
+        self._names = {}  # Or expression id -> the name it is defined under
+
+    def write(self, constraints, packages):
+        for package in packages:
+            if package not in self._declared:
+                self._declared.add(package)
+                self.file.write(f"(declare-fun {String(package, ctx=self.ctx).sexpr()} () String)\n")
+        for constraint in constraints:
+            if is_implies(constraint):
+                # Printing an Or is the costly part, so each one is printed once. The solver
+                # keeps the expressions alive, so their ids are not reused during the run
+                condition, dependency_constraint = constraint.children()
+                name = self._names.get(dependency_constraint.get_id())
+                if name is None:
+                    # Package names cannot contain "!", so this never clashes with a package
+                    name = self._names[dependency_constraint.get_id()] = f"candidates!{len(self._names)}"
+                    self.file.write(f"(define-fun {name} () Bool {dependency_constraint.sexpr()})\n")
+                self.file.write(f"(assert (=> {condition.sexpr()} {name}))\n")
+            else:
+                self.file.write(f"(assert {constraint.sexpr()})\n")
+
+    def close(self):
+        self.file.write("(check-sat)\n")
+
+
+# with minimization function
+
+def generate_smt_expression(
+    direct_dependencies, transitive_dependencies, ctx, add_soft_clauses, minimize_packages, expression_file=None
+):
+    """
+    Generate an SMT (Satisfiability Modulo Theories) expression to handle package version constraints,
+    including both direct and transitive dependencies, using an Optimize solver.
+
+    Args:
+    direct_dependencies (dict): A dictionary where keys are package names and values are lists of matching versions.
+    transitive_dependencies (dict): A dictionary where keys are "package==version" and values are dictionaries of transitive dependencies.
+    add_soft_clauses (bool): Flag to indicate whether to add soft clauses or not.
+    minimize_packages (bool): Flag to indicate whether to minimize the number of packages included in the solution.
+    expression_file (file): Optional text file that receives the expression in SMT-LIB form, as
+                            `generate_smt_expression_streaming` writes it.
+
+    Returns:
+    tuple: An Optimize solver instance with the added constraints and the list of constraints.
+    """
+    # Initialize an Optimize solver to handle both hard and soft constraints
+    solver = Optimize(ctx=ctx)
+    constraints = []
+    is_included_vars = {}  # Dictionary to store the binary inclusion variables
+    disjunctions = {}  # Identical candidate sets of a package share one Or expression
+
+    # Generate constraints for direct dependencies
+    constraints.extend(
+        _direct_constraints(solver, ctx, direct_dependencies, is_included_vars, add_soft_clauses, minimize_packages)
+    )
 
     # Generate constraints for transitive dependencies
     for package_version, dependencies in transitive_dependencies.items():
@@ -142,43 +248,23 @@ def generate_smt_expression(
             # Split the package_version to get the package name and its version
             package, version = package_version.split("==")
             for dep_package, dep_versions in dependencies.items():
-                # Create a constraint for each dependency that it must be one of the specified versions
-                expressions = [
-                    String(dep_package, ctx=ctx) == dep_version
-                    for dep_version in dep_versions
-                ]
-                if len(expressions) == 0:
-                    continue
-                dependency_constraint = Or(expressions)
                 constraints.append(
-                    Implies(
-                        String(package, ctx=ctx) == version,
-                        dependency_constraint,
+                    _dependency_constraint(
+                        solver, ctx, package, version, dep_package, dep_versions,
+                        disjunctions, is_included_vars, add_soft_clauses, minimize_packages,
                     )
                 )
-                
-                # Create and add binary inclusion variable for the dependent package with the same context
-                if minimize_packages:
-                    if dep_package not in is_included_vars:
-                        is_included_vars[dep_package] = Bool(f'is_included_{dep_package}', ctx=ctx)
-                    solver.add(Implies(is_included_vars[dep_package], dependency_constraint))
-                    solver.add(Implies(dependency_constraint, is_included_vars[dep_package]))
-
-                if add_soft_clauses:
-                    # Add soft constraints with weights for versions
-                    sorted_versions = sorted(
-                        dep_versions, reverse=False
-                    )  # Sort versions to prioritize newer versions
-                    weight = 1
-                    for dep_version in sorted_versions:
-                        # Add a soft constraint with increasing weight for newer versions
-                        solver.add_soft(
-                            String(dep_package, ctx=ctx) == dep_version, weight
-                        )
-                        weight += 1  # Increment the weight for the next version
 
     # Combine all constraints into a single final constraint
     assert len(constraints) > 0
+    if expression_file is not None:
+        packages = [package for package, versions in direct_dependencies.items() if versions]
+        for package_version, dependencies in transitive_dependencies.items():
+            packages.append(package_version.split("==")[0])
+            packages.extend(dependencies)
+        writer = _ExpressionWriter(expression_file, ctx)
+        writer.write(constraints, packages)
+        writer.close()
     final_constraint = And(constraints)
     solver.add(final_constraint)
 
@@ -190,6 +276,68 @@ def generate_smt_expression(
 
 
 
+def generate_smt_expression_streaming(
+    direct_dependencies, edge_batches, ctx, add_soft_clauses, minimize_packages, expression_file=None
+):
+    """
+    Build the same constraints as `generate_smt_expression`, consuming the transitive
+    dependencies as batches of edges instead of a complete dictionary.
+
+    Each batch's constraints are added to the solver, and written to `expression_file`, before
+    the next batch is requested, so nothing but the solver keeps the problem: there is no
+    dependencies dictionary, constraint list or `str(solver)` copy of it. Identical candidate
+    sets still share one Or expression.
+
+    Args:
+    direct_dependencies (dict): A dictionary where keys are package names and values are lists of matching versions.
+    edge_batches (iterable): Lists of ("package==version", dependency, matching versions) edges,
+                             e.g. from `dependency.stream_transitive_dependencies`.
+    add_soft_clauses (bool): Flag to indicate whether to add soft clauses or not.
+    minimize_packages (bool): Flag to indicate whether to minimize the number of packages included in the solution.
+    expression_file (file): Optional text file that receives the expression in SMT-LIB form as it is built.
+
+    Returns:
+    Optimize: The solver instance with the added constraints.
+    """
+    solver = Optimize(ctx=ctx)
+    is_included_vars = {}
+    disjunctions = {}
+    writer = None if expression_file is None else _ExpressionWriter(expression_file, ctx)
+
+    def _add(constraints, packages):
+        solver.add(constraints)
+        if writer is not None:
+            writer.write(constraints, packages)
+
+    constraints = _direct_constraints(
+        solver, ctx, direct_dependencies, is_included_vars, add_soft_clauses, minimize_packages
+    )
+    _add(constraints, [package for package, versions in direct_dependencies.items() if versions])
+    added = len(constraints)
+    for batch in edge_batches:
+        constraints = []
+        packages = []
+        for package_version, dep_package, dep_versions in batch:
+            package, version = package_version.split("==")
+            constraints.append(
+                _dependency_constraint(
+                    solver, ctx, package, version, dep_package, dep_versions,
+                    disjunctions, is_included_vars, add_soft_clauses, minimize_packages,
+                )
+            )
+            packages += (package, dep_package)
+        _add(constraints, packages)
+        added += len(constraints)
+    assert added > 0
+
+    if minimize_packages:
+        solver.minimize(Sum([If(is_included_vars[pkg], 1, 0) for pkg in is_included_vars]))
+    if writer is not None:
+        writer.close()
+    return solver
+
+
+
 
 def verify_solution(solver, model):
     # Check if the solution satisfies all constraints
@@ -0,0 +1,38 @@
+import closure_cache
+from closure_cache import ClosureCache
+
+
+def test_pending_expansions_are_written_in_bounded_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(closure_cache, "_MAX_PENDING", 3)
+    path = str(tmp_path / "KGraph.kgc.closure-cache")
+    context = ClosureCache.context_key(None, "explicit")
+    cache = ClosureCache(path, "fingerprint")
+    for number in range(10):
+        cache.put(context, "pkg", f"{number}.0", (), [("dep", number)])
+        assert len(cache._pending) < 3
+    assert len(cache) == 10
+    cache.close()
+
+    cache = ClosureCache(path, "fingerprint")
+    try:
+        assert [cache.get(context, "pkg", f"{number}.0", ()) for number in range(10)] == [
+            [("dep", number)] for number in range(10)
+        ]
+        assert cache.get(context, "pkg", "1.0", ("extra",)) is None
+    finally:
+        cache.close()
+
+
+def test_another_graph_empties_the_cache(tmp_path):
+    path = str(tmp_path / "KGraph.kgc.closure-cache")
+    context = ClosureCache.context_key(None, "explicit")
+    cache = ClosureCache(path, "fingerprint")
+    cache.put(context, "pkg", "1.0", (), [("dep", 1)])
+    cache.close()
+
+    cache = ClosureCache(path, "other fingerprint")
+    try:
+        assert cache.emptied
+        assert cache.get(context, "pkg", "1.0", ()) is None
+    finally:
+        cache.close()
@@ -0,0 +1,125 @@
+from closure import ClosureWalk, ParallelClosureWalk
+from dependency import (
+    fetch_direct_dependencies,
+    fetch_transitive_dependencies,
+    marker_applies,
+    marker_environment,
+    split_extras,
+)
+
+
+KG = {
+    "projects": {
+        "app": {"1.0": {"dependency_packages": ["requests[socks]>=2.31"]}},
+        "requests": {
+            "2.31.0": {
+                "dependency_packages": [
+                    "idna<4,>=2.5",
+                    'PySocks!=1.5.7; extra == "socks"',
+                    'win-inet-pton; sys_platform == "win32" and extra == "socks"',
+                    'chardet<5; python_version < "3"',
+                ]
+            },
+            "2.30.0": {"dependency_packages": ["idna<4,>=2.5"]},
+        },
+        "idna": {
+            "3.7": {"dependency_packages": []},
+            "2.5": {"dependency_packages": []},
+            "1.0": {"dependency_packages": []},
+        },
+        "PySocks": {"1.7.1": {"dependency_packages": []}, "1.5.7": {"dependency_packages": []}},
+        "win-inet-pton": {"1.1.0": {"dependency_packages": []}},
+        "chardet": {"4.0.0": {"dependency_packages": []}},
+    }
+}
+
+LINUX = marker_environment("3.8", "linux")
+
+
+def _lists(transitive):
+    return {
+        package_version: {package: list(versions) for package, versions in dependencies.items()}
+        for package_version, dependencies in transitive.items()
+    }
+
+
+def _closure(direct, environment=None):
+    return _lists(fetch_transitive_dependencies(direct, KG, environment=environment))
+
+
+def test_split_extras():
+    assert split_extras("requests") == ("requests", ())
+    assert split_extras("requests[socks]") == ("requests", ("socks",))
+    assert split_extras(" requests [ socks, security ,socks] ") == ("requests", ("security", "socks"))
+    assert split_extras("requests[]") == ("requests", ())
+
+
+def test_marker_applies():
+    assert marker_applies(None, LINUX)
+    assert marker_applies('python_version >= "3"', LINUX)
+    assert not marker_applies('python_version < "3"', LINUX)
+    assert not marker_applies('sys_platform == "win32"', LINUX)
+    # Without an environment every marker but the extras part holds
+    assert marker_applies('python_version < "3"', None)
+    # An extra marker holds only when one of its extras was requested
+    assert not marker_applies('extra == "socks"', None)
+    assert marker_applies('extra == "socks"', None, frozenset({"socks"}))
+    assert not marker_applies('extra == "socks"', None, frozenset({"security"}))
+    assert not marker_applies('sys_platform == "win32" and extra == "socks"', LINUX, frozenset({"socks"}))
+    # A marker that cannot be parsed keeps the edge
+    assert marker_applies("not a marker", LINUX)
+
+
+def test_direct_extras_become_pseudo_packages():
+    direct = fetch_direct_dependencies({"Requests": [(">=", "2.31")]}, KG, {"Requests": ("Socks",)})
+    assert direct == {"requests": ["2.31.0"], "requests[socks]": ["2.31.0"]}
+
+
+def test_extra_pins_its_base_package_and_owns_its_edges():
+    direct = fetch_direct_dependencies({"app": []}, KG)
+    assert _closure(direct, LINUX) == {
+        "app==1.0": {"requests": ["2.31.0"], "requests[socks]": ["2.31.0"]},
+        # The base package keeps only the edges that are not conditional on an extra
+        "requests==2.31.0": {"idna": ["3.7", "2.5"]},
+        "requests[socks]==2.31.0": {"requests": ["2.31.0"], "PySocks": ["1.7.1"]},
+    }
+
+
+def test_marker_gated_edges_follow_the_environment():
+    direct = fetch_direct_dependencies({"requests": [(">=", "2.31")]}, KG, {"requests": ("socks",)})
+    assert _closure(direct) == {
+        "requests==2.31.0": {"idna": ["3.7", "2.5"], "chardet": ["4.0.0"]},
+        "requests[socks]==2.31.0": {
+            "requests": ["2.31.0"],
+            "PySocks": ["1.7.1"],
+            "win-inet-pton": ["1.1.0"],
+        },
+    }
+    windows = marker_environment("2.7", "win32")
+    assert _closure(direct, windows)["requests[socks]==2.31.0"]["win-inet-pton"] == ["1.1.0"]
+    assert "win-inet-pton" not in _closure(direct, LINUX)["requests[socks]==2.31.0"]
+    assert "chardet" not in _closure(direct, LINUX)["requests==2.31.0"]
+
+
+def test_parallel_walk_matches_serial_walk():
+    direct = fetch_direct_dependencies({"app": [], "requests": []}, KG, {"requests": ("socks",)})
+    serial = ClosureWalk(KG)
+    parallel = ParallelClosureWalk(KG, min_parallel=1)
+    parallel.workers = 2  # Also on a single CPU, where the pool would not be used
+    for walk in (serial, parallel):
+        for package, versions in direct.items():
+            walk.add(package, versions)
+        walk.run()
+    expected = _lists(serial.result())
+    assert _lists(parallel.result()) == expected
+    assert list(parallel.result()) == list(expected)
+
+
+def test_parallel_chunks_keep_the_versions_of_a_package_together():
+    walk = ParallelClosureWalk(KG)
+    walk.workers = 2
+    tasks = [("idna", version, ()) for version in ("3.7", "2.5", "1.0")]
+    tasks += [("PySocks", "1.7.1", ()), ("requests", "2.31.0", ()), ("chardet", "4.0.0", ())]
+    chunks = walk._partition(tasks)
+    assert sorted(position for chunk in chunks for position in chunk) == list(range(len(tasks)))
+    assert [0, 1, 2] in [sorted(chunk) for chunk in chunks]
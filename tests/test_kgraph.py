@@ -0,0 +1,194 @@
+import json
+import os
+
+from dependency import parse_dependency_record
+from kgraph import CompiledKG, compile_kg, is_compiled_kg_fresh, load_sidecar, merge_delta
+from version_order import VersionIndex, is_prerelease
+
+
+SOCKS_DEPENDENCIES = ["idna<4,>=2.5", "urllib3>=1.21.1", 'PySocks!=1.5.7; extra == "socks"']
+
+PROJECTS = {
+    "requests": {
+        "2.31.0": {"dependency_packages": list(SOCKS_DEPENDENCIES)},
+        "2.0.0": {"dependency_packages": []},  # Empty, right before versions that share a list
+        "2.32.0rc1": {"dependency_packages": list(SOCKS_DEPENDENCIES)},
+        "2.1.0": {"dependency_packages": None},
+    },
+    "idna": {
+        "3.7": {"dependency_packages": []},
+        "2.5": {"dependency_packages": []},
+        "3.0a1": {"dependency_packages": []},
+    },
+    "urllib3": {
+        "1.26.18": {"dependency_packages": ['brotli>=1.0.9; platform_python_implementation == "CPython"']},
+        "2.2.1": {"dependency_packages": ["idna[all]"]},
+    },
+    "PySocks": {
+        "1.7.1": {"dependency_packages": []},
+        "2004d": {"dependency_packages": []},  # Not a PEP 440 version
+    },
+}
+
+DELTA = {
+    "idna": {"3.8": {"dependency_packages": []}},
+    "urllib3": {"2.2.1": {"dependency_packages": ["idna>=3"]}},
+    "certifi": {"2024.2.2": {"dependency_packages": ["urllib3"]}},
+}
+
+
+def _write_json(path, projects):
+    with open(path, "w") as file:
+        json.dump({"projects": projects}, file)
+
+
+def _compile(tmp_path, projects=PROJECTS):
+    json_path = str(tmp_path / "KGraph.json")
+    compiled_path = str(tmp_path / "KGraph.kgc")
+    _write_json(json_path, projects)
+    compile_kg(json_path, compiled_path)
+    return json_path, compiled_path
+
+
+def _merged(projects, delta):
+    merged = json.loads(json.dumps(projects))
+    for package, versions in delta.items():
+        entry = merged.setdefault(package, {})
+        for version, version_data in versions.items():
+            if version not in entry:
+                entry[version] = version_data
+            else:
+                entry[version]["dependency_packages"] += version_data["dependency_packages"]
+    return merged
+
+
+def _check_round_trip(kg, projects):
+    assert sorted(kg.package_names()) == sorted(projects)
+    for package, versions in projects.items():
+        assert kg.versions(package) == list(versions)
+        assert kg.package_entry(package) == versions
+        assert dict(kg.projects[package]) == versions
+
+        # Order and pre-release flags come from the store, not from parsing the versions again
+        index = kg.version_index(package)
+        assert index.versions == VersionIndex(list(versions)).versions
+        assert set(index.final_releases()) == {version for version in versions if not is_prerelease(version)}
+
+        for version, version_data in versions.items():
+            dependencies = version_data["dependency_packages"] or ()
+            expected = tuple(parse_dependency_record(dependency) for dependency in dependencies)
+            assert kg.dependency_edges(package, version) == expected, (package, version)
+    assert kg.dependency_edges("requests", "9.9") is None
+    assert kg.dependency_edges("missing", "1.0") is None
+
+
+def _reverse(kg, package):
+    return sorted((name, version, record.name) for name, version, record in kg.reverse_dependencies(package))
+
+
+def test_compiled_store_round_trips(tmp_path):
+    _, compiled_path = _compile(tmp_path)
+    kg = CompiledKG(compiled_path)
+    try:
+        assert kg.generation == 0
+        assert kg.changed_packages() == set()
+        _check_round_trip(kg, PROJECTS)
+        assert _reverse(kg, "IDNA") == [
+            ("requests", "2.31.0", "idna"),
+            ("requests", "2.32.0rc1", "idna"),
+            ("urllib3", "2.2.1", "idna"),
+        ]
+        assert _reverse(kg, "pysocks") == [("requests", "2.31.0", "PySocks"), ("requests", "2.32.0rc1", "PySocks")]
+        assert _reverse(kg, "certifi") == []
+    finally:
+        kg.close()
+
+
+def test_merged_delta_adds_releases_and_packages(tmp_path):
+    _, compiled_path = _compile(tmp_path)
+    delta_path = str(tmp_path / "delta.json")
+    _write_json(delta_path, DELTA)
+
+    result = merge_delta(compiled_path, delta_path)
+    assert result["generation"] == 1
+    assert sorted(result["changed"]) == ["certifi", "idna", "urllib3"]
+
+    kg = CompiledKG(compiled_path)
+    try:
+        assert kg.generation == 1
+        _check_round_trip(kg, _merged(PROJECTS, DELTA))
+        assert kg.changed_packages(0) == {"certifi", "idna", "urllib3"}
+        assert kg.changed_packages(1) == set()
+        assert _reverse(kg, "idna") == [
+            ("requests", "2.31.0", "idna"),
+            ("requests", "2.32.0rc1", "idna"),
+            ("urllib3", "2.2.1", "idna"),
+            ("urllib3", "2.2.1", "idna"),
+        ]
+        assert _reverse(kg, "urllib3") == [
+            ("certifi", "2024.2.2", "urllib3"),
+            ("requests", "2.31.0", "urllib3"),
+            ("requests", "2.32.0rc1", "urllib3"),
+        ]
+    finally:
+        kg.close()
+
+    # A delta that adds nothing leaves the store at its generation
+    assert merge_delta(compiled_path, delta_path) == {"generation": 1, "changed": []}
+
+
+def test_compiled_store_goes_stale_when_the_json_changes(tmp_path):
+    json_path, compiled_path = _compile(tmp_path)
+    assert is_compiled_kg_fresh(compiled_path, json_path)
+
+    _write_json(json_path, dict(PROJECTS, certifi={"2024.2.2": {"dependency_packages": []}}))
+    compiled_mtime = os.path.getmtime(compiled_path)
+    os.utime(json_path, (compiled_mtime + 10, compiled_mtime + 10))
+    assert not is_compiled_kg_fresh(compiled_path, json_path)
+
+    compile_kg(json_path, compiled_path)
+    os.utime(compiled_path, (compiled_mtime + 20, compiled_mtime + 20))
+    assert is_compiled_kg_fresh(compiled_path, json_path)
+
+
+def test_batch_matching_agrees_with_single_queries(tmp_path):
+    _, compiled_path = _compile(tmp_path)
+    kg = CompiledKG(compiled_path)
+    try:
+        queries = [
+            ("IDNA", (("<", "4"), (">=", "2.5"))),
+            ("requests", ()),
+            ("missing", ((">=", "1.0"),)),
+            ("idna", ((">=", "2.5"), ("<", "4"))),  # The first query, specifiers reordered
+            ("requests", ((">", "2.31.0"),)),  # Only a pre-release matches
+        ]
+        batch = kg.projects.find_matching_versions_many(queries)
+        single = [kg.projects.find_matching_versions(package, specs) for package, specs in queries]
+        assert [list(matches) for matches in batch] == [list(matches) for matches in single]
+        assert list(batch[0]) == ["3.7", "2.5"]
+        assert list(batch[4]) == ["2.32.0rc1"]
+    finally:
+        kg.close()
+
+
+def test_sidecar_is_rebuilt_when_its_file_changes(tmp_path):
+    path = str(tmp_path / "KGraph.json")
+    _write_json(path, PROJECTS)
+    builds = []
+
+    def build():
+        builds.append(os.path.getsize(path))
+        return builds[-1]
+
+    assert load_sidecar(path, ".size", "size_of", build) == os.path.getsize(path)
+    assert load_sidecar(path, ".size", "size_of", build) == os.path.getsize(path)
+    assert len(builds) == 1
+
+    _write_json(path, dict(PROJECTS, certifi={"2024.2.2": {"dependency_packages": []}}))
+    assert load_sidecar(path, ".size", "size_of", build) == os.path.getsize(path)
+    assert len(builds) == 2
+
+    with open(path + ".size", "w") as file:
+        file.write("not json")
+    assert load_sidecar(path, ".size", "size_of", build) == os.path.getsize(path)
+    assert len(builds) == 3
@@ -0,0 +1,134 @@
+import io
+import random
+
+import pytest
+from z3 import Context, Solver, sat, unsat
+
+from dominance import prune_dominated
+from equivalence import collapse_version_classes
+from presolve import presolve
+from smt import generate_smt_expression
+from version_order import VersionIndex, VersionSet
+
+
+TRIALS = 300
+
+
+def _random_problem(rng):
+    """
+    Returns a small random (direct_dependencies, transitive_dependencies) problem.
+    """
+    packages = [f"p{number}" for number in range(rng.randint(2, 6))]
+    indexes = {
+        package: VersionIndex([f"{major}.0" for major in range(1, rng.randint(2, 5))]) for package in packages
+    }
+
+    def _candidates(package):
+        if rng.random() < 0.1:
+            return VersionSet(indexes[package])  # A dependency no version satisfies
+        return VersionSet(indexes[package], rng.randint(0, (1 << len(indexes[package])) - 1))
+
+    direct = {}
+    for package in rng.sample(packages, rng.randint(1, 2)):
+        versions = indexes[package].versions
+        direct[package] = [version for version in versions if rng.random() < 0.7] or [versions[0]]
+    transitive = {}
+    for package in packages:
+        for version in indexes[package].versions:
+            dependencies = {
+                dep_package: _candidates(dep_package)
+                for dep_package in packages
+                if dep_package != package and rng.random() < 0.4
+            }
+            if dependencies:
+                transitive[f"{package}=={version}"] = dependencies
+    return direct, transitive
+
+
+def _solve(direct, transitive):
+    """
+    Returns {package: version} for a solution of the problem, or None when it has none.
+    """
+    ctx = Context()
+    solver = generate_smt_expression(direct, transitive, ctx, add_soft_clauses=False, minimize_packages=False)
+    if solver.check() != sat:
+        return None
+    model = solver.model()
+    return {declaration.name(): model[declaration].as_string() for declaration in model.decls()}
+
+
+def _satisfies(direct, transitive, solution):
+    """
+    Check a solution against the problem without the solver.
+    """
+    for package, versions in direct.items():
+        if versions and solution.get(package) not in versions:
+            return False
+    for package_version, dependencies in transitive.items():
+        package, version = package_version.split("==")
+        if solution.get(package) != version:
+            continue
+        for dep_package, versions in dependencies.items():
+            if solution.get(dep_package) not in versions:
+                return False
+    return True
+
+
+def _presolve(direct, transitive):
+    return presolve(direct, transitive)
+
+
+def _collapse(direct, transitive):
+    return collapse_version_classes(direct, transitive)[:2]
+
+
+def _prune(direct, transitive):
+    return prune_dominated(direct, transitive)[:2]
+
+
+def _all(direct, transitive):
+    # In the order SMTpip applies them
+    return _prune(*_collapse(*_presolve(direct, transitive)))
+
+
+@pytest.mark.parametrize("reduce", [_presolve, _collapse, _prune, _all])
+def test_reduction_keeps_satisfiability(reduce):
+    rng = random.Random(20240611)
+    for trial in range(TRIALS):
+        direct, transitive = _random_problem(rng)
+        reduced_direct, reduced_transitive = reduce(direct, transitive)
+        expected = _solve(direct, transitive)
+        solution = _solve(reduced_direct, reduced_transitive)
+        assert (solution is None) == (expected is None), trial
+        if solution is not None:
+            assert _satisfies(direct, transitive, solution), trial
+
+
+def test_newer_version_with_fewer_dependencies_dominates():
+    q = VersionIndex(["1.0", "2.0"])
+    direct = {"p": ["2.0", "1.0"]}
+    transitive = {"p==1.0": {"q": VersionSet(q, 0b01)}, "p==2.0": {"q": VersionSet(q, 0b11)}}
+    pruned_direct, pruned_transitive, dominated = prune_dominated(direct, transitive)
+    assert dominated["p"] == {"1.0": "2.0"}
+    assert pruned_direct == {"p": ["2.0"]}
+    assert set(pruned_transitive) == {"p==2.0"}
+
+
+def test_expression_file_defines_shared_candidates_once():
+    q = VersionIndex(["1.0", "2.0"])
+    direct = {"p": ["1.0", "2.0"]}
+    transitive = {"p==1.0": {"q": VersionSet(q, 0b01)}, "p==2.0": {"q": VersionSet(q, 0b01)}}
+    expression = io.StringIO()
+    generate_smt_expression(
+        direct, transitive, Context(), add_soft_clauses=False, minimize_packages=False, expression_file=expression
+    )
+    text = expression.getvalue()
+    assert text.count("define-fun") == 1
+    assert text.count('(= q "1.0")') == 1
+
+    ctx = Context()
+    solver = Solver(ctx=ctx)
+    solver.from_string(text)
+    assert solver.check() == sat
+    solver.from_string('(assert (= q "2.0"))')
+    assert solver.check() == unsat
@@ -0,0 +1,62 @@
+import pytest
+
+from dependency import fetch_direct_dependencies, marker_environment
+from kgraph import LoadedProjects
+from requirements import parse_requirements
+from version_order import PRERELEASES_EXPLICIT, PRERELEASES_STABLE
+
+
+PROJECTS = {
+    "jupyterhub": {version: {"dependency_packages": []} for version in ["1.0.1", "1.0.0", "1.0.0b1", "0.9.6"]},
+    "foo": {version: {"dependency_packages": []} for version in ["1.0.post1", "1.0"]},
+}
+
+
+def test_specifiers_are_kept_whole():
+    requirements = parse_requirements(
+        "\n".join(
+            [
+                "jupyterhub>=1.0.0b1,<1.0.1",
+                "foo==1.0.post1  # Pinned for a fix",
+                "Django~=3.2",
+                "bar==1.0.0b1",
+                "",
+                "# A comment",
+                "-r other-requirements.txt",
+                "numpy",
+                "numpy<2",
+            ]
+        )
+    )
+    assert requirements == {
+        "jupyterhub": [("<", "1.0.1"), (">=", "1.0.0b1")],
+        "foo": [("==", "1.0.post1")],
+        "Django": [("~=", "3.2")],
+        "bar": [("==", "1.0.0b1")],
+        "numpy": [("<", "2")],
+    }
+
+
+def test_extras_and_markers():
+    extras = {}
+    requirements = parse_requirements(
+        'requests[socks,security]>=2.0; python_version >= "3"\nlegacy==1.0; python_version < "3"\n',
+        marker_environment("3.8"),
+        extras,
+    )
+    assert requirements == {"requests": [(">=", "2.0")]}
+    assert extras == {"requests": ["security", "socks"]}
+
+
+@pytest.mark.parametrize(
+    "policy, expected",
+    [
+        (PRERELEASES_EXPLICIT, {"jupyterhub": ["1.0.0", "1.0.0b1"], "bar": ["1.0.0b1"], "foo": ["1.0.post1"]}),
+        (PRERELEASES_STABLE, {"jupyterhub": ["1.0.0"], "bar": [], "foo": ["1.0.post1"]}),
+    ],
+)
+def test_prerelease_pins(policy, expected):
+    projects = LoadedProjects(dict(PROJECTS, bar={"1.0.0b1": {"dependency_packages": []}}))
+    projects.prerelease_policy = policy
+    requirements = parse_requirements("jupyterhub>=1.0.0b1,<1.0.1\nbar==1.0.0b1\nfoo==1.0.post1\n")
+    assert fetch_direct_dependencies(requirements, {"projects": projects}) == expected
@@ -0,0 +1,60 @@
+from itertools import combinations
+
+import pytest
+from packaging.specifiers import SpecifierSet
+
+from version_order import PRERELEASES_ALL, PRERELEASES_EXPLICIT, PRERELEASES_STABLE, VersionIndex
+
+
+VERSIONS = [
+    "0.9", "1.0.dev1", "1.0a1", "1.0b2", "1.0rc1", "1.0", "1.0+local.1", "1.0.post1", "1.0.1",
+    "1.1.dev0", "1.1", "1.1.0.post2", "1.2rc1", "1.2", "1.2.3", "1.10", "2.0a1", "2.0", "2.0.0.1",
+    "2.1.post1.dev3", "3!0.5", "10.0",
+]
+
+SPECIFIED = ["1.0", "1.0b2", "1.1", "1.2", "1.2rc1", "2.0", "2.0a1", "1.0.post1", "3!0.5"]
+
+
+WILDCARDS = ["1.*", "1.0.*", "1.1.*", "2.*", "3!0.*"]
+
+
+def _specifiers():
+    singles = [
+        (operator, version)
+        for version in SPECIFIED
+        for operator in ("==", "!=", "<", "<=", ">", ">=", "~=", "===")
+        if operator != "~=" or "." in version  # A compatible release needs two release segments
+    ]
+    singles.extend((operator, version) for version in WILDCARDS for operator in ("==", "!="))
+    specs = [(spec,) for spec in singles]
+    specs.extend(combinations(singles[::3], 2))
+    return specs
+
+
+def _matches(index, specs, prereleases):
+    return set(index.match_set(specs, prereleases).ascending())
+
+
+@pytest.mark.parametrize(
+    "policy, prereleases",
+    [(PRERELEASES_EXPLICIT, None), (PRERELEASES_ALL, True), (PRERELEASES_STABLE, False)],
+)
+def test_match_set_agrees_with_specifier_set(policy, prereleases):
+    index = VersionIndex(VERSIONS)
+    for specs in _specifiers():
+        specifier_set = SpecifierSet(",".join(operator + version for operator, version in specs))
+        expected = set(specifier_set.filter(VERSIONS, prereleases=prereleases))
+        assert _matches(index, specs, policy) == expected, specs
+
+
+@pytest.mark.parametrize(
+    "policy, prereleases",
+    [(PRERELEASES_EXPLICIT, None), (PRERELEASES_ALL, True), (PRERELEASES_STABLE, False)],
+)
+def test_match_sets_agrees_with_specifier_set(policy, prereleases):
+    index = VersionIndex(VERSIONS)
+    spec_sets = _specifiers()
+    for specs, matches in zip(spec_sets, index.match_sets(spec_sets, policy)):
+        specifier_set = SpecifierSet(",".join(operator + version for operator, version in specs))
+        expected = set(specifier_set.filter(VERSIONS, prereleases=prereleases))
+        assert set(matches.ascending()) == expected, specs
@@ -0,0 +1,444 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from packaging.version import InvalidVersion, Version
+
+
+_keys = {}  # Version strings repeat across packages, parse each one once
+
+DEFAULT_MATCH_CACHE_SIZE = 16384
+
+# Pre-release policies: never admit pre-releases, admit them only when a specifier names
+# one or nothing else matches (the PEP 440 default), or admit every version
+PRERELEASES_STABLE = "stable"
+PRERELEASES_EXPLICIT = "explicit"
+PRERELEASES_ALL = "all"
+PRERELEASE_POLICIES = (PRERELEASES_STABLE, PRERELEASES_EXPLICIT, PRERELEASES_ALL)
+
+
+def version_key(version):
+    """
+    Returns the PEP 440 sort key of a version string.
+
+    Strings that are not valid PEP 440 versions sort before every valid one, in string
+    order, so any list of knowledge graph versions can be sorted.
+    """
+    key = _keys.get(version)
+    if key is None:
+        try:
+            key = (1, Version(version))
+        except InvalidVersion:
+            key = (0, version)
+        _keys[version] = key
+    return key
+
+
+def is_prerelease(version):
+    """
+    Check whether a version string is a PEP 440 pre-release or development release.
+    Strings that are not valid PEP 440 versions count as final releases.
+    """
+    kind, parsed = version_key(version)
+    return kind == 1 and parsed.is_prerelease
+
+
+def _names_prerelease(specs):
+    # As in PEP 440, excluding a pre-release with != does not opt in to pre-releases
+    return any(
+        is_prerelease(spec_version)
+        for operator, spec_version in specs
+        if operator != "!=" and not spec_version.endswith(".*")
+    )
+
+
+def _release_upper_bound(release, epoch):
+    """
+    Returns the smallest version above every version whose release starts with `release`,
+    e.g. 1.5.dev0 for 1.4.
+    """
+    release = list(release)
+    release[-1] += 1
+    prefix = f"{epoch}!" if epoch else ""
+    return prefix + ".".join(str(part) for part in release) + ".dev0"
+
+
+def _is_post_or_local_of(version, base):
+    return (version.is_postrelease or version.local is not None) and Version(version.base_version) == base
+
+
+def _is_local_of(version, public):
+    return version.local is not None and Version(version.public) == public
+
+
+class _SortKeys:
+    """
+    Sequence view of the sort keys of already sorted versions. A binary search only
+    parses the handful of versions it probes.
+    """
+
+    def __init__(self, versions):
+        self._versions = versions
+
+    def __len__(self):
+        return len(self._versions)
+
+    def __getitem__(self, position):
+        return version_key(self._versions[position])
+
+
+class VersionIndex:
+    """
+    The versions of one package sorted by PEP 440, each identified by its integer rank.
+
+    A specifier is located in the sorted versions once, with a binary search, and turned
+    into a range of ranks; checking a version against it is then an integer comparison.
+    A specifier set becomes the intersection of those ranges, a union of disjoint rank
+    intervals, so matching costs O(log n) per specifier plus the size of the result.
+    """
+
+    def __init__(self, versions, order=None, prereleases=None):
+        """
+        Parameters:
+            versions (iterable): The version strings of the package.
+            order (sequence): Optional positions of `versions` in ascending PEP 440 order,
+                              as precomputed by the compiled store.
+            prereleases (sequence): Optional pre-release flag of each of `versions`, as
+                                    precomputed by the compiled store.
+        """
+        versions = list(versions)
+        if order is None:
+            order = sorted(range(len(versions)), key=lambda position: version_key(versions[position]))
+        self.versions = tuple(versions[position] for position in order)
+        self._final_bits = None
+        if prereleases is not None:
+            self._final_bits = sum(
+                1 << rank for rank, position in enumerate(order) if not prereleases[position]
+            )
+        self._newest_first = self.versions[::-1]
+        self.ranks = {version: rank for rank, version in enumerate(self.versions)}
+        self._keys = _SortKeys(self.versions)
+        self._bounds = {}
+
+    def __len__(self):
+        return len(self.versions)
+
+    def latest(self):
+        """
+        Returns the newest version, or None for a package without versions.
+        """
+        return self.versions[-1] if self.versions else None
+
+    def _first_at_least(self, version):
+        return bisect_left(self._keys, version_key(version))
+
+    def bounds(self, spec):
+        """
+        Translate one (operator, version) specifier into ranks.
+
+        Returns:
+            tuple: (low, high, negate); a version of rank r satisfies the specifier when
+                   `(low <= r < high) != negate`.
+        """
+        bounds = self._bounds.get(spec)
+        if bounds is None:
+            bounds = self._bounds[spec] = self._compute_bounds(*spec)
+        return bounds
+
+    def _compute_bounds(self, operator, spec_version):
+        count = len(self.versions)
+        if operator == "===":
+            rank = self.ranks.get(spec_version)
+            return (0, 0, False) if rank is None else (rank, rank + 1, False)
+
+        if spec_version.endswith(".*"):
+            if operator not in ("==", "!="):
+                return (0, 0, False)
+            try:
+                prefix = Version(spec_version[:-2])
+            except InvalidVersion:
+                return (0, 0, False)
+            low = self._first_at_least(spec_version[:-2] + ".dev0")
+            high = self._first_at_least(_release_upper_bound(prefix.release, prefix.epoch))
+            return (low, high, operator == "!=")
+
+        try:
+            parsed = Version(spec_version)
+        except InvalidVersion:
+            parsed = None
+        key = version_key(spec_version)
+        low, high = bisect_left(self._keys, key), bisect_right(self._keys, key)
+        if parsed is not None and parsed.local is None and operator in ("==", "!=", "<="):
+            # Without a local label, V also stands for its local versions, which sort right after it
+            while high < count and _is_local_of(self._keys[high][1], parsed):
+                high += 1
+
+        if operator == "==":
+            return (low, high, False)
+        if operator == "!=":
+            return (low, high, True)
+        if operator == ">=":
+            return (low, count, False)
+        if operator == "<=":
+            return (0, high, False)
+        if operator == ">":
+            # ">V" does not admit post-releases or local versions of V, which sort right after it
+            if parsed is not None and not parsed.is_postrelease:
+                base = Version(parsed.base_version)
+                while high < count and _is_post_or_local_of(self._keys[high][1], base):
+                    high += 1
+            return (high, count, False)
+        if operator == "<":
+            # "<V" does not admit pre-releases of a final release V
+            if parsed is not None and not parsed.is_prerelease and parsed.post is None:
+                low = self._first_at_least(f"{parsed.public}.dev0")
+            return (0, low, False)
+        if operator == "~=":
+            # ~=1.4.5 means >=1.4.5 together with ==1.4.*
+            if parsed is None:
+                return (0, 0, False)
+            release = parsed.release[:-1] or parsed.release
+            return (low, self._first_at_least(_release_upper_bound(release, parsed.epoch)), False)
+        return (0, 0, False)  # Unknown operator, nothing matches
+
+    def satisfies(self, version, specs):
+        """
+        Check whether one version of this package satisfies every specifier.
+        """
+        rank = self.ranks.get(version)
+        if rank is None:
+            return False
+        for spec in specs:
+            low, high, negate = self.bounds(spec)
+            if (low <= rank < high) == negate:
+                return False
+        return True
+
+    def intervals(self, specs):
+        """
+        Compile a specifier set into the ranks of the versions that satisfy it.
+
+        Returns:
+            list: Disjoint, ascending (low, high) rank intervals, high exclusive.
+        """
+        count = len(self.versions)
+        intervals = [(0, count)]
+        for spec in specs:
+            low, high, negate = self.bounds(spec)
+            allowed = [(0, low), (high, count)] if negate else [(low, high)]
+            intervals = [
+                (max(start, allowed_start), min(end, allowed_end))
+                for start, end in intervals
+                for allowed_start, allowed_end in allowed
+                if max(start, allowed_start) < min(end, allowed_end)
+            ]
+            if not intervals:
+                break
+        return intervals
+
+    def matching(self, specs):
+        """
+        Returns the versions that satisfy every (operator, version) specifier, newest
+        first like the knowledge graph lists them.
+        """
+        count = len(self.versions)
+        matches = []
+        for low, high in reversed(self.intervals(specs)):
+            matches.extend(self._newest_first[count - high : count - low])
+        return matches
+
+    def final_releases(self):
+        """
+        Returns a `VersionSet` of the versions that are not pre-releases.
+        """
+        if self._final_bits is None:
+            self._final_bits = sum(
+                1 << rank for rank, version in enumerate(self.versions) if not is_prerelease(version)
+            )
+        return VersionSet(self, self._final_bits)
+
+    def match_set(self, specs, prereleases=PRERELEASES_ALL):
+        """
+        Like `matching`, but returns the matches as a `VersionSet`.
+
+        Parameters:
+            specs (sequence): (operator, version) specifiers.
+            prereleases (str): One of `PRERELEASE_POLICIES`. Under PRERELEASES_EXPLICIT,
+                               pre-releases only match when a specifier names a pre-release
+                               or when no final release matches.
+        """
+        bits = 0
+        for low, high in self.intervals(specs):
+            bits |= ((1 << (high - low)) - 1) << low
+        return VersionSet(self, self._admit_prereleases(bits, specs, prereleases))
+
+    def match_sets(self, spec_sets, prereleases=PRERELEASES_ALL):
+        """
+        Match many specifier sets against this package in one call.
+
+        Each distinct specifier is turned into a bitset of the ranks that satisfy it once,
+        and each set is the AND of the bitsets of its specifiers, so sets that share
+        specifiers, like the edges "idna<4,>=2.5" and "idna>=2.5" of two dependents, share
+        the work.
+
+        Parameters:
+            spec_sets (sequence): Specifier sets, each a sequence of (operator, version) pairs.
+            prereleases (str): One of `PRERELEASE_POLICIES`, as for `match_set`.
+
+        Returns:
+            list: One `VersionSet` per specifier set, in the same order.
+        """
+        everything = (1 << len(self.versions)) - 1
+        masks = {}
+        results = []
+        for specs in spec_sets:
+            bits = everything
+            for spec in specs:
+                mask = masks.get(spec)
+                if mask is None:
+                    low, high, negate = self.bounds(spec)
+                    mask = (1 << high) - (1 << low) if low < high else 0
+                    mask = masks[spec] = mask ^ everything if negate else mask
+                bits &= mask
+                if not bits:
+                    break
+            results.append(VersionSet(self, self._admit_prereleases(bits, specs, prereleases)))
+        return results
+
+    def _admit_prereleases(self, bits, specs, prereleases):
+        # Apply a pre-release policy to the ranks that satisfy `specs`
+        if prereleases == PRERELEASES_STABLE:
+            return bits & self.final_releases().bits
+        if prereleases == PRERELEASES_EXPLICIT and bits and not _names_prerelease(specs):
+            # Pre-releases stay in only when nothing else matches
+            return (bits & self.final_releases().bits) or bits
+        return bits
+
+    def all_versions(self):
+        """
+        Returns a `VersionSet` holding every version of the package.
+        """
+        return VersionSet(self, (1 << len(self.versions)) - 1)
+
+
+class VersionSet:
+    """
+    A set of versions of one package, stored as a bitset over its `VersionIndex`: bit i
+    stands for the version of rank i. Intersection, union, difference and emptiness are
+    operations on one integer.
+
+    Iterating yields the version strings newest first, so a `VersionSet` can be used
+    wherever a list of candidate versions was expected. Sets are immutable and hashable.
+    """
+
+    __slots__ = ("index", "bits")
+
+    def __init__(self, index, bits=0):
+        self.index = index
+        self.bits = bits
+
+    def _check(self, other):
+        if other.index is not self.index:
+            raise ValueError("VersionSets of different packages cannot be combined")
+
+    def __and__(self, other):
+        self._check(other)
+        return VersionSet(self.index, self.bits & other.bits)
+
+    def __or__(self, other):
+        self._check(other)
+        return VersionSet(self.index, self.bits | other.bits)
+
+    def __sub__(self, other):
+        self._check(other)
+        return VersionSet(self.index, self.bits & ~other.bits)
+
+    def __bool__(self):
+        return self.bits != 0
+
+    def __len__(self):
+        return bin(self.bits).count("1")
+
+    def __contains__(self, version):
+        rank = self.index.ranks.get(version)
+        return rank is not None and (self.bits >> rank) & 1 == 1
+
+    def ranks(self):
+        """
+        Returns the ranks of the versions in the set, newest first.
+        """
+        ranks = []
+        bits = self.bits
+        while bits:
+            rank = bits.bit_length() - 1
+            ranks.append(rank)
+            bits ^= 1 << rank
+        return ranks
+
+    def __iter__(self):
+        versions = self.index.versions
+        return (versions[rank] for rank in self.ranks())
+
+    def ascending(self):
+        """
+        Returns the versions in the set, oldest first.
+        """
+        versions = self.index.versions
+        return [versions[rank] for rank in reversed(self.ranks())]
+
+    def __eq__(self, other):
+        if not isinstance(other, VersionSet):
+            return NotImplemented
+        return self.index is other.index and self.bits == other.bits
+
+    def __hash__(self):
+        return hash((id(self.index), self.bits))
+
+    def __repr__(self):
+        return f"VersionSet({list(self)!r})"
+
+
+def normalize_specs(specs):
+    """
+    Returns a specifier set in a canonical form: sorted, without duplicates, as a tuple.
+    """
+    return tuple(sorted(set(specs)))
+
+
+class MatchCache:
+    """
+    Least-recently-used cache of specifier matches, keyed by (package, normalized specs,
+    pre-release policy).
+
+    The same dependency edge, e.g. "idna<4,>=2.5", appears under many versions of its
+    dependents; after the first lookup every repeat is a dictionary hit returning the
+    same `VersionSet`.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MATCH_CACHE_SIZE):
+        """
+        Parameters:
+            maxsize (int): Most entries to keep; None keeps every entry, 0 disables the cache.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        matches = self._entries.get(key)
+        if matches is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return matches
+
+    def put(self, key, matches):
+        if self.maxsize == 0:
+            return
+        self._entries[key] = matches
+        if self.maxsize is not None and len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)